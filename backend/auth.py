@@ -1,24 +1,55 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
+from jose import JWTError, ExpiredSignatureError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
+import hashlib
+import threading
+import time
+import httpx
 from uuid import UUID
 
-from database import get_db, db, supabase, verify_token as supabase_verify_token
+from database import get_db, db, supabase, SUPABASE_URL, SUPABASE_KEY, verify_token as supabase_verify_token
+from utils import TTLCache
+from schemas_supabase import UserResponse, columns_for
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Supabase access token verification
+# "local" checks signatures against the cached JWT secret/JWKS, "remote" asks the auth server
+JWT_VERIFICATION_MODE = os.getenv("JWT_VERIFICATION_MODE", "local")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL", f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json")
+JWKS_CACHE_TTL = int(os.getenv("JWKS_CACHE_TTL", "600"))
+JWKS_MIN_REFRESH_INTERVAL = 30
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+
+# User record cache
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "2048"))
+
+# Session cache: access token -> user id, seeded at login. Profiles are always
+# read through user_cache, so a changed user is seen within USER_CACHE_TTL.
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "300"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "4096"))
+
+# Columns of users that UserResponse and the auth checks need (no password_hash)
+USER_PROFILE_COLUMNS = columns_for(UserResponse, table="users")
+
 # Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "12"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=PASSWORD_HASH_ROUNDS)
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
@@ -40,24 +71,176 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class SigningKeyUnavailable(Exception):
+    """Raised when no local key can verify a token, so the auth server must."""
+
+class JWKSCache:
+    """Caches the Supabase JWKS and refetches it when keys rotate."""
+
+    def __init__(self, url: str, ttl: int = JWKS_CACHE_TTL):
+        self.url = url
+        self.ttl = ttl
+        self._keys: dict = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            response = httpx.get(self.url, headers={"apikey": SUPABASE_KEY}, timeout=5)
+            response.raise_for_status()
+            self._keys = {key["kid"]: key for key in response.json().get("keys", []) if key.get("kid")}
+        except Exception as e:
+            # Keep serving the previous key set if the refresh fails
+            print(f"JWKS refresh failed: {e}")
+        self._fetched_at = time.monotonic()
+
+    def get_key(self, kid: Optional[str]) -> Optional[dict]:
+        with self._lock:
+            age = time.monotonic() - self._fetched_at
+            # Unknown kid usually means the keys were rotated; refetch, but rate-limited
+            if age > self.ttl or (kid not in self._keys and age > JWKS_MIN_REFRESH_INTERVAL):
+                self._refresh()
+            return self._keys.get(kid)
+
+jwks_cache = JWKSCache(SUPABASE_JWKS_URL)
+
+# Recently verified tokens, keyed by token hash and expiring at the token's exp
+verified_tokens = TTLCache(maxsize=TOKEN_CACHE_SIZE)
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _decode_supabase_token(token: str) -> dict:
+    """Verify a Supabase access token locally and return its claims."""
+    header = jwt.get_unverified_header(token)
+    algorithm = header.get("alg")
+    
+    if algorithm == "HS256":
+        if not SUPABASE_JWT_SECRET:
+            raise SigningKeyUnavailable()
+        key = SUPABASE_JWT_SECRET
+    else:
+        key = jwks_cache.get_key(header.get("kid"))
+        if key is None:
+            raise SigningKeyUnavailable()
+    
+    return jwt.decode(token, key, algorithms=[algorithm], audience=SUPABASE_JWT_AUDIENCE)
+
+def _verify_token_remotely(token: str) -> Optional[dict]:
+    """Ask the Supabase auth server to validate the token."""
+    user = supabase_verify_token(token)
+    if user and user.user:
+        return {"sub": str(user.user.id), "exp": jwt.get_unverified_claims(token).get("exp")}
+    return None
+
 def verify_token(token: str) -> Optional[str]:
     """Verify a JWT token using Supabase."""
+    token_key = _token_key(token)
+    cached_user_id = verified_tokens.get(token_key)
+    if cached_user_id is not None:
+        return cached_user_id
+    
     try:
-        # First try Supabase token verification
-        user = supabase_verify_token(token)
-        if user and user.user:
-            return str(user.user.id)
+        payload = None
+        try:
+            if JWT_VERIFICATION_MODE == "local":
+                payload = _decode_supabase_token(token)
+            else:
+                payload = _verify_token_remotely(token)
+        except SigningKeyUnavailable:
+            payload = _verify_token_remotely(token)
+        except ExpiredSignatureError:
+            return None
+        except JWTError:
+            payload = None
         
         # Fallback to custom JWT verification
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if payload is None:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        
         user_id: str = payload.get("sub")
         if user_id is None:
             return None
+        
+        exp = payload.get("exp")
+        if exp:
+            verified_tokens.set(token_key, user_id, ttl=exp - time.time())
         return user_id
     except JWTError:
         return None
 
+# Recently loaded user rows, keyed by user id
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+def get_user_record(user_id: str) -> Optional[dict]:
+    """Load a user row, serving it from the cache when possible."""
+    user = user_cache.get(user_id)
+    if user is None:
+        user_data = db.select("users", columns=USER_PROFILE_COLUMNS, filters={"id": user_id})
+        if not user_data.data:
+            return None
+        user = user_data.data[0]
+        user_cache.set(user_id, user)
+    return dict(user)
+
+# Sessions by token hash, stored as (user_id, user generation). Bumping a
+# user's generation retires all of their cached sessions at once.
+session_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+_user_generations: dict = {}
+
+def start_session(token: str, user: dict, expires_at: Optional[float] = None) -> None:
+    """Cache a freshly issued or verified token and its profile so requests skip verification and lookup."""
+    user_id = str(user["id"])
+    ttl = SESSION_CACHE_TTL if expires_at is None else min(SESSION_CACHE_TTL, expires_at - time.time())
+    session_cache.set(_token_key(token), (user_id, _user_generations.get(user_id, 0)), ttl=ttl)
+    user_cache.set(user_id, dict(user))
+    if expires_at is not None:
+        verified_tokens.set(_token_key(token), user_id, ttl=expires_at - time.time())
+
+def get_session_user(token: str) -> Optional[dict]:
+    """The current profile for a cached token, unless the user was invalidated since."""
+    entry = session_cache.get(_token_key(token))
+    if entry is None:
+        return None
+    user_id, generation = entry
+    if generation != _user_generations.get(user_id, 0):
+        return None
+    return get_user_record(user_id)
+
+def invalidate_user(user_id) -> None:
+    """Drop a cached user row and its sessions so the next request reloads it."""
+    user_id = str(user_id)
+    user_cache.pop(user_id)
+    _user_generations[user_id] = _user_generations.get(user_id, 0) + 1
+
+def set_user_status(user_id, is_active: Optional[bool] = None, is_admin: Optional[bool] = None):
+    """Change a user's active/admin flags and invalidate the cached row."""
+    update_data = {}
+    if is_active is not None:
+        update_data["is_active"] = is_active
+    if is_admin is not None:
+        update_data["is_admin"] = is_admin
+    
+    result = db.update("users", update_data, {"id": str(user_id)})
+    invalidate_user(user_id)
+    return result
+
+def _load_request_user(request: Request, token: str) -> Optional[dict]:
+    """Resolve the token's user once per request, whichever dependency asks first."""
+    memo = getattr(request.state, "auth_user", None)
+    if memo is not None and memo[0] == token:
+        return memo[1]
+    
+    # Tokens issued by /auth/login resolve from the session cache in one lookup
+    user = get_session_user(token)
+    if user is None:
+        user_id = verify_token(token)
+        user = get_user_record(user_id) if user_id is not None else None
+    request.state.auth_user = (token, user)
+    return user
+
 def get_current_user(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> dict:
     """Get the current authenticated user."""
@@ -67,17 +250,10 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    user_id = verify_token(credentials.credentials)
-    if user_id is None:
-        raise credentials_exception
-    
-    # Get user from Supabase
-    user_data = db.select("users", filters={"id": user_id})
-    if not user_data.data:
+    user = _load_request_user(request, credentials.credentials)
+    if user is None:
         raise credentials_exception
     
-    user = user_data.data[0]
-    
     if not user.get("is_active", True):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -96,23 +272,15 @@ def get_current_admin_user(current_user: dict = Depends(get_current_user)) -> di
     return current_user
 
 def get_optional_current_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
 ) -> Optional[dict]:
     """Get the current user if authenticated, otherwise return None."""
     if not credentials:
         return None
     
-    user_id = verify_token(credentials.credentials)
-    if user_id is None:
-        return None
-    
-    # Get user from Supabase
-    user_data = db.select("users", filters={"id": user_id})
-    if not user_data.data:
-        return None
-    
-    user = user_data.data[0]
-    if user is None or not user.is_active:
+    user = _load_request_user(request, credentials.credentials)
+    if user is None or not user.get("is_active", True):
         return None
     
     return user
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for checkout: many buyers race for a product with little stock.
+
+Runs against the Supabase project in .env (needs create_order_from_cart from
+supabase_schema.sql). Creates a throwaway product and buyers, fires all
+checkouts at once, verifies nothing was oversold, then cleans up.
+
+    python checkout_concurrency_check.py --buyers 50 --stock 10
+"""
+
+import argparse
+import asyncio
+import uuid
+
+from postgrest.exceptions import APIError
+
+from database import async_db
+from utils import generate_order_number
+
+async def checkout(user_id: str):
+    try:
+        result = await async_db.rpc("create_order_from_cart", {
+            "p_user_id": user_id,
+            "p_order_number": generate_order_number(),
+            "p_details": {}
+        })
+        return result.data["order_id"]
+    except APIError as e:
+        return e
+
+async def run(buyers: int, stock: int, quantity: int):
+    run_id = uuid.uuid4().hex[:8]
+    product_id = str(uuid.uuid4())
+    user_ids = [str(uuid.uuid4()) for _ in range(buyers)]
+
+    await async_db.insert("products", {
+        "id": product_id,
+        "name": f"Checkout race {run_id}",
+        "slug": f"checkout-race-{run_id}",
+        "price": 100,
+        "stock_quantity": stock,
+        "is_active": False
+    })
+    await async_db.insert("users", [{
+        "id": user_id,
+        "email": f"race-{run_id}-{n}@example.com",
+        "password_hash": "!",
+        "first_name": "Race",
+        "last_name": str(n)
+    } for n, user_id in enumerate(user_ids)])
+    await async_db.insert("cart_items", [
+        {"user_id": user_id, "product_id": product_id, "quantity": quantity}
+        for user_id in user_ids
+    ])
+
+    try:
+        results = await asyncio.gather(*(checkout(user_id) for user_id in user_ids))
+        order_ids = [r for r in results if not isinstance(r, Exception)]
+        failures = [r for r in results if isinstance(r, Exception)]
+
+        product = await async_db.select("products", columns="stock_quantity", filters={"id": product_id})
+        final_stock = product.data[0]["stock_quantity"]
+        sold = len(order_ids) * quantity
+        expected_orders = min(buyers, stock // quantity)
+
+        print(f"Buyers: {buyers}, stock: {stock}, quantity per order: {quantity}")
+        print(f"Orders placed: {len(order_ids)} (expected {expected_orders})")
+        print(f"Rejected: {len(failures)}")
+        for message in sorted({f.message for f in failures}):
+            print(f"   {message}")
+        print(f"Final stock: {final_stock} (expected {stock - sold})")
+
+        ok = (
+            final_stock >= 0
+            and final_stock == stock - sold
+            and len(order_ids) == expected_orders
+            and all("Insufficient stock" in (f.message or "") for f in failures)
+        )
+        print("✅ No overselling" if ok else "❌ Checkout is not consistent under concurrency")
+        return ok
+    finally:
+        # order_items cascade with their orders
+        await async_db.execute(async_db.table("orders").delete().in_("user_id", user_ids))
+        await async_db.execute(async_db.table("cart_items").delete().in_("user_id", user_ids))
+        await async_db.execute(async_db.table("users").delete().in_("id", user_ids))
+        await async_db.delete("products", {"id": product_id})
+        await async_db.aclose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=50)
+    parser.add_argument("--stock", type=int, default=10)
+    parser.add_argument("--quantity", type=int, default=1)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args.buyers, args.stock, args.quantity))
+    raise SystemExit(0 if ok else 1)
@@ -1,8 +1,13 @@
 from supabase import create_client, Client
+from postgrest import AsyncPostgrestClient
+import asyncio
+import httpx
 import os
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 from dotenv import load_dotenv
 
+from utils import TTLCache, VersionedCache, encode_cursor, decode_cursor
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -10,6 +15,26 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
 
+# Keys per `in` filter in batch loads; keeps request URLs well under proxy limits
+BATCH_LOAD_CHUNK_SIZE = int(os.getenv("BATCH_LOAD_CHUNK_SIZE", "100"))
+
+# Async connection pool configuration
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20"))
+SUPABASE_POOL_KEEPALIVE = int(os.getenv("SUPABASE_POOL_KEEPALIVE", "10"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+
+# Cached total counts for cursor pagination
+COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL", "60"))
+COUNT_CACHE_SIZE = int(os.getenv("COUNT_CACHE_SIZE", "512"))
+
+# Cached catalog (product/category) reads, invalidated by admin writes
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "60"))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "1024"))
+
+# Cached per-user cart summaries (badge count/subtotal), dropped on cart writes
+CART_SUMMARY_CACHE_TTL = int(os.getenv("CART_SUMMARY_CACHE_TTL", "30"))
+CART_SUMMARY_CACHE_SIZE = int(os.getenv("CART_SUMMARY_CACHE_SIZE", "4096"))
+
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY environment variables are required")
 
@@ -72,8 +97,312 @@ class SupabaseDB:
         """Call a PostgreSQL function"""
         return self.client.rpc(function_name, params or {}).execute()
 
-# Create database instance
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor is malformed or belongs to another sort."""
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """PostgREST client backed by a bounded, reusable HTTP/2 connection pool."""
+
+    def __init__(self, base_url: str, headers: dict, timeout: float, pool_size: int, keepalive: int):
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        super().__init__(base_url, headers=headers, timeout=timeout)
+
+    def create_session(self, base_url, headers, timeout, verify=True):
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=verify,
+            follow_redirects=True,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.keepalive
+            )
+        )
+
+class AsyncSupabaseDB:
+    """Non-blocking counterpart of SupabaseDB for use inside async handlers.
+
+    Every call goes through one shared connection pool, so a slow PostgREST
+    request only occupies a pooled connection instead of the event loop.
+    """
+
+    def __init__(
+        self,
+        url: str = SUPABASE_URL,
+        key: str = SUPABASE_KEY,
+        pool_size: int = SUPABASE_POOL_SIZE,
+        keepalive: int = SUPABASE_POOL_KEEPALIVE,
+        timeout: float = SUPABASE_TIMEOUT
+    ):
+        self.rest_url = f"{url.rstrip('/')}/rest/v1"
+        self.headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._client: Optional[PooledPostgrestClient] = None
+
+    @property
+    def client(self) -> PooledPostgrestClient:
+        """Lazily create the pooled client on first use."""
+        if self._client is None:
+            self._client = PooledPostgrestClient(
+                self.rest_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                pool_size=self.pool_size,
+                keepalive=self.keepalive
+            )
+        return self._client
+
+    def table(self, table: str):
+        """Start an async query builder for a table"""
+        return self.client.from_(table)
+
+    def rpc_table(self, function_name: str, params: dict = None):
+        """Start an async query builder over the rows of a set-returning function"""
+        return self.client.rpc(function_name, params or {})
+
+    async def execute(self, query, timeout: Optional[float] = None):
+        """Execute a query builder, bounded by a per-call timeout"""
+        return await asyncio.wait_for(query.execute(), timeout or self.timeout)
+
+    async def select(self, table: str, columns: str = "*", filters: Optional[dict] = None, timeout: Optional[float] = None):
+        """Select data from table with optional filters"""
+        query = self.table(table).select(columns)
+        
+        if filters:
+            for key, value in filters.items():
+                if isinstance(value, dict):
+                    # Handle operators like {"gte": 100} or {"ilike": "%search%"}
+                    for operator, operand in value.items():
+                        query = getattr(query, operator)(key, operand)
+                else:
+                    query = query.eq(key, value)
+        
+        return await self.execute(query, timeout)
+    
+    async def batch_load(
+        self,
+        table: str,
+        key_column: str,
+        keys: Iterable,
+        columns: str = "*",
+        many: bool = False,
+        timeout: Optional[float] = None
+    ) -> Dict[str, object]:
+        """Load rows for many keys with `in` queries instead of one query per key.
+        
+        Returns {str(key): row}, or {str(key): [rows]} when many=True. `columns`
+        must include key_column. Missing keys are simply absent from the result.
+        """
+        unique_keys = list(dict.fromkeys(str(key) for key in keys if key is not None))
+        if not unique_keys:
+            return {}
+        
+        chunks = [
+            unique_keys[start:start + BATCH_LOAD_CHUNK_SIZE]
+            for start in range(0, len(unique_keys), BATCH_LOAD_CHUNK_SIZE)
+        ]
+        results = await asyncio.gather(*(
+            self.execute(self.table(table).select(columns).in_(key_column, chunk), timeout)
+            for chunk in chunks
+        ))
+        
+        loaded: Dict[str, object] = {}
+        for result in results:
+            for row in result.data or []:
+                key = str(row[key_column])
+                if many:
+                    loaded.setdefault(key, []).append(row)
+                else:
+                    loaded[key] = row
+        return loaded
+    
+    async def insert(self, table: str, data, timeout: Optional[float] = None):
+        """Insert data into table"""
+        return await self.execute(self.table(table).insert(data), timeout)
+    
+    async def update(self, table: str, data: dict, filters: dict, timeout: Optional[float] = None):
+        """Update data in table"""
+        query = self.table(table).update(data)
+        
+        for key, value in filters.items():
+            query = query.eq(key, value)
+            
+        return await self.execute(query, timeout)
+    
+    async def delete(self, table: str, filters: dict, timeout: Optional[float] = None):
+        """Delete data from table"""
+        query = self.table(table).delete()
+        
+        for key, value in filters.items():
+            query = query.eq(key, value)
+            
+        return await self.execute(query, timeout)
+    
+    async def upsert(self, table: str, data, timeout: Optional[float] = None):
+        """Insert or update data"""
+        return await self.execute(self.table(table).upsert(data), timeout)
+    
+    async def rpc(self, function_name: str, params: dict = None, timeout: Optional[float] = None):
+        """Call a PostgreSQL function"""
+        return await self.execute(self.client.rpc(function_name, params or {}), timeout)
+
+    async def cached_count(self, cache_key, query, timeout: Optional[float] = None) -> int:
+        """Run a count query, reusing a recent result for the same cache key"""
+        total = count_cache.get(cache_key)
+        if total is None:
+            result = await self.execute(query, timeout)
+            total = result.count if result.count is not None else 0
+            count_cache.set(cache_key, total)
+        return total
+
+    async def paginate(
+        self,
+        query,
+        ordering: "Ordering",
+        *,
+        limit: int,
+        page: int = 1,
+        use_cursor: bool = False,
+        cursor: Optional[str] = None,
+        sort: str = "default",
+        count_key=None,
+        count_query=None,
+        nullable: Sequence[str] = ()
+    ) -> Tuple[list, dict]:
+        """Fetch one page of an ordered query together with its pagination meta.
+
+        The total is read from the page request itself (Prefer: count=exact),
+        so a page normally costs one round trip. Cursor mode seeks past the
+        sort key encoded in `cursor` and caches the total under count_key;
+        count_query, built with the same filters, only runs when a later
+        cursor page misses that cache.
+        Raises InvalidCursorError when the cursor does not belong to this sort.
+        """
+        if use_cursor and not ordering:
+            raise InvalidCursorError("Cursor pagination is not available for this sort")
+        
+        query = apply_order(query, ordering, nullable)
+        
+        if not use_cursor:
+            offset = (page - 1) * limit
+            result = await self.execute(with_count(query).range(offset, offset + limit - 1))
+            total = result.count if result.count is not None else 0
+            return result.data or [], {
+                "page": page,
+                "per_page": limit,
+                "total": total,
+                "pages": (total + limit - 1) // limit
+            }
+        
+        total = count_cache.get(count_key)
+        if cursor:
+            position = decode_cursor(cursor, sort)
+            if position is None or len(position) != len(ordering):
+                raise InvalidCursorError("Invalid cursor")
+            query = query.or_(keyset_filter(ordering, position, nullable))
+            if total is None and count_query is not None:
+                total = await self.cached_count(count_key, with_count(count_query).limit(1))
+        elif total is None:
+            # The first page sees every matching row, so it can carry the count
+            query = with_count(query)
+        
+        # Fetch one extra row to learn whether another page exists
+        result = await self.execute(query.limit(limit + 1))
+        if total is None:
+            total = result.count if result.count is not None else 0
+            count_cache.set(count_key, total)
+        
+        rows = result.data or []
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(sort, cursor_values(rows[-1], ordering))
+        
+        return rows, {
+            "per_page": limit,
+            "total": total,
+            "pages": (total + limit - 1) // limit,
+            "next_cursor": next_cursor
+        }
+
+    async def aclose(self):
+        """Release pooled connections (called on application shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# Keyset pagination helpers
+# An ordering is a list of (column, descending) pairs whose last column is unique (usually id).
+Ordering = List[Tuple[str, bool]]
+
+def apply_order(query, ordering: Ordering, nullable: Sequence[str] = ()):
+    """Apply a multi-column ORDER BY; nullable columns sort their NULLs last"""
+    if not ordering:
+        return query
+    order = ",".join(
+        f"{column}.{'desc' if desc else 'asc'}{'.nullslast' if column in nullable else ''}"
+        for column, desc in ordering
+    )
+    query.params = query.params.add("order", order)
+    return query
+
+def with_count(query):
+    """Ask PostgREST to report the exact total in Content-Range"""
+    query.headers["Prefer"] = "count=exact"
+    return query
+
+def _quote_filter_value(value) -> str:
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+def keyset_filter(ordering: Ordering, values: list, nullable: Sequence[str] = ()) -> str:
+    """Build a PostgREST or=() expression selecting rows after the given sort key.
+
+    Expands (a, b, id) > (va, vb, vid) into
+    a > va OR (a = va AND b > vb) OR (a = va AND b = vb AND id > vid),
+    honouring each column's direction. Must match apply_order() with the same
+    nullable columns, whose NULLs sort last.
+    """
+    branches = []
+    for i, (column, desc) in enumerate(ordering):
+        equal_parts = []
+        for (prev_column, _), prev_value in zip(ordering[:i], values[:i]):
+            if prev_value is None:
+                equal_parts.append(f"{prev_column}.is.null")
+            else:
+                equal_parts.append(f"{prev_column}.eq.{_quote_filter_value(prev_value)}")
+        
+        value = values[i]
+        after_parts = []
+        if value is not None:
+            after_parts.append(f"{column}.{'lt' if desc else 'gt'}.{_quote_filter_value(value)}")
+            if column in nullable:
+                after_parts.append(f"{column}.is.null")
+        # Nothing sorts after NULL, since NULLs come last
+        
+        for after in after_parts:
+            parts = equal_parts + [after]
+            branches.append(parts[0] if len(parts) == 1 else f"and({','.join(parts)})")
+    
+    return ",".join(branches)
+
+def cursor_values(row: dict, ordering: Ordering) -> list:
+    """Extract the sort key of a row for encoding into a cursor"""
+    return [row.get(column) for column, _ in ordering]
+
+# Create database instances
 db = SupabaseDB()
+async_db = AsyncSupabaseDB()
+count_cache = TTLCache(maxsize=COUNT_CACHE_SIZE, ttl=COUNT_CACHE_TTL)
+# Namespaces: "products" and "categories". Product rows embed their category,
+# so category writes bump both.
+catalog_cache = VersionedCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+cart_summary_cache = TTLCache(maxsize=CART_SUMMARY_CACHE_SIZE, ttl=CART_SUMMARY_CACHE_TTL)
 
 # Dependency to get database client
 def get_db():
@@ -83,6 +412,10 @@ def get_db():
 def get_supabase_db():
     return db
 
+# Dependency to get the pooled async database client
+def get_async_db():
+    return async_db
+
 # Authentication helpers
 def verify_token(token: str):
     """Verify JWT token"""
@@ -0,0 +1,103 @@
+"""
+Anonymous carts kept client-side in a signed token.
+
+Guests can fill a cart without an account and without any database writes.
+The cart is a compact HMAC-signed token sent as the guest_cart cookie, or in
+the X-Guest-Cart header by clients that keep it in local storage. On login it
+is merged into cart_items in one call (merge_guest_cart in supabase_schema.sql).
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import uuid
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+
+from database import async_db, cart_summary_cache
+
+GUEST_CART_COOKIE = "guest_cart"
+GUEST_CART_HEADER = "X-Guest-Cart"
+GUEST_CART_SECRET = (os.getenv("GUEST_CART_SECRET") or os.getenv("SECRET_KEY") or "").encode()
+GUEST_CART_MAX_AGE = int(os.getenv("GUEST_CART_MAX_AGE", str(30 * 24 * 3600)))
+GUEST_CART_COOKIE_SECURE = os.getenv("GUEST_CART_COOKIE_SECURE", "false").lower() == "true"
+
+# Never fall back to a built-in default: anyone could forge carts with it
+if not GUEST_CART_SECRET:
+    raise ValueError("GUEST_CART_SECRET or SECRET_KEY environment variable is required")
+
+# Keep the token well under the 4KB cookie limit
+GUEST_CART_MAX_ITEMS = 50
+GUEST_CART_MAX_QUANTITY = 99
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(body: str) -> str:
+    return _b64encode(hmac.new(GUEST_CART_SECRET, body.encode(), hashlib.sha256).digest()[:16])
+
+def encode_guest_cart(items: Dict[str, int]) -> str:
+    """Serialize {product_id: quantity} into a signed token (~30 bytes per item)."""
+    payload = [[_b64encode(uuid.UUID(product_id).bytes), quantity] for product_id, quantity in items.items()]
+    body = _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+    return f"{body}.{_sign(body)}"
+
+def decode_guest_cart(token: Optional[str]) -> Dict[str, int]:
+    """Inverse of encode_guest_cart; a missing, malformed or tampered token is an empty cart."""
+    if not token or "." not in token:
+        return {}
+
+    body, signature = token.rsplit(".", 1)
+    if not hmac.compare_digest(signature, _sign(body)):
+        return {}
+
+    try:
+        items = {}
+        for product_id, quantity in json.loads(_b64decode(body)):
+            if isinstance(quantity, int) and 0 < quantity <= GUEST_CART_MAX_QUANTITY:
+                items[str(uuid.UUID(bytes=_b64decode(product_id)))] = quantity
+        return dict(list(items.items())[:GUEST_CART_MAX_ITEMS])
+    except (ValueError, TypeError):
+        return {}
+
+def read_guest_cart(request: Request) -> Dict[str, int]:
+    """The guest cart carried by a request (cookie first, then header)."""
+    return decode_guest_cart(request.cookies.get(GUEST_CART_COOKIE) or request.headers.get(GUEST_CART_HEADER))
+
+def write_guest_cart(response: Response, items: Dict[str, int]) -> Optional[str]:
+    """Set (or, for an empty cart, clear) the guest cart cookie; returns the token."""
+    if not items:
+        clear_guest_cart(response)
+        return None
+
+    token = encode_guest_cart(items)
+    response.set_cookie(
+        GUEST_CART_COOKIE,
+        token,
+        max_age=GUEST_CART_MAX_AGE,
+        httponly=True,
+        secure=GUEST_CART_COOKIE_SECURE,
+        samesite="lax"
+    )
+    return token
+
+def clear_guest_cart(response: Response) -> None:
+    response.delete_cookie(GUEST_CART_COOKIE, httponly=True, secure=GUEST_CART_COOKIE_SECURE, samesite="lax")
+
+async def merge_guest_cart(user_id: str, items: Dict[str, int]) -> int:
+    """Merge a guest cart into the user's cart_items in one call; returns rows written."""
+    if not items:
+        return 0
+
+    result = await async_db.rpc("merge_guest_cart", {
+        "p_user_id": str(user_id),
+        "p_items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in items.items()]
+    })
+    cart_summary_cache.pop(str(user_id))
+    return result.data or 0
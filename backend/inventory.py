@@ -0,0 +1,149 @@
+"""
+Inventory holds for checkout.
+
+Holds live in the inventory_holds table and are taken, consumed and swept by
+the SQL functions in supabase_schema.sql (reserve_cart, create_order_from_cart,
+release_expired_holds). This module wraps those calls and keeps per-process
+metrics on how often buyers collide over the same stock.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from postgrest.exceptions import APIError
+
+from database import async_db
+
+# Hold lifetime and sweep cadence
+HOLD_TTL_SECONDS = int(os.getenv("HOLD_TTL_SECONDS", "600"))
+HOLD_SWEEP_INTERVAL = int(os.getenv("HOLD_SWEEP_INTERVAL", "30"))
+
+# SQLSTATE of a plain RAISE EXCEPTION; the message is safe to show to the buyer
+HOLD_ERROR_CODE = "P0001"
+INSUFFICIENT_STOCK_PREFIX = "Insufficient stock for product: "
+
+class HoldRejected(Exception):
+    """The cart could not be reserved (empty cart or not enough stock)."""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+class ReservationMetrics:
+    """Thread-safe counters for hold requests and stock contention."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.attempts = 0
+            self.granted = 0
+            self.rejected = 0  # Lost the race for stock
+            self.invalid = 0   # Empty cart and other caller errors
+            self.errors = 0
+            self.released = 0
+            self.swept = 0
+            self.in_flight = 0
+            self.peak_in_flight = 0
+            self.total_latency = 0.0
+            self.max_latency = 0.0
+            self.rejected_by_product: Counter = Counter()
+
+    def started(self) -> float:
+        with self._lock:
+            self.attempts += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def finished(self, started_at: float, outcome: str, product: Optional[str] = None) -> None:
+        latency = time.perf_counter() - started_at
+        with self._lock:
+            self.in_flight -= 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            if product:
+                self.rejected_by_product[product] += 1
+
+    def add(self, counter: str, amount: int) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def stats(self) -> dict:
+        """Snapshot for monitoring; contention_rate is the share of holds lost to other buyers."""
+        with self._lock:
+            completed = self.attempts - self.in_flight
+            return {
+                "attempts": self.attempts,
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "invalid": self.invalid,
+                "errors": self.errors,
+                "released": self.released,
+                "swept": self.swept,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "contention_rate": round(self.rejected / completed, 4) if completed else 0.0,
+                "avg_latency_ms": round(self.total_latency / completed * 1000, 2) if completed else 0.0,
+                "max_latency_ms": round(self.max_latency * 1000, 2),
+                "most_contended": self.rejected_by_product.most_common(5)
+            }
+
+metrics = ReservationMetrics()
+
+async def reserve_cart(user_id: str, ttl_seconds: Optional[int] = None) -> dict:
+    """Hold the user's whole cart; returns {"expires_at", "items"} or raises HoldRejected."""
+    started_at = metrics.started()
+    try:
+        result = await async_db.rpc("reserve_cart", {
+            "p_user_id": str(user_id),
+            "p_ttl_seconds": ttl_seconds or HOLD_TTL_SECONDS
+        })
+    except APIError as e:
+        if e.code != HOLD_ERROR_CODE:
+            metrics.finished(started_at, "errors")
+            raise
+        message = e.message or "Cart could not be reserved"
+        if message.startswith(INSUFFICIENT_STOCK_PREFIX):
+            metrics.finished(started_at, "rejected", message[len(INSUFFICIENT_STOCK_PREFIX):])
+        else:
+            metrics.finished(started_at, "invalid")
+        raise HoldRejected(message)
+    except Exception:
+        metrics.finished(started_at, "errors")
+        raise
+
+    metrics.finished(started_at, "granted")
+    return result.data
+
+async def release_cart(user_id: str) -> int:
+    """Drop the user's holds (checkout abandoned); returns the number released."""
+    result = await async_db.rpc("release_cart_holds", {"p_user_id": str(user_id)})
+    released = result.data or 0
+    metrics.add("released", released)
+    return released
+
+async def sweep_expired_holds() -> int:
+    """Delete expired holds once; returns the number removed."""
+    result = await async_db.rpc("release_expired_holds")
+    swept = result.data or 0
+    metrics.add("swept", swept)
+    return swept
+
+async def run_hold_sweeper(interval: int = HOLD_SWEEP_INTERVAL):
+    """Background task: sweep expired holds every `interval` seconds until cancelled."""
+    while True:
+        try:
+            await sweep_expired_holds()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Inventory hold sweep failed: {e}")
+        await asyncio.sleep(interval)
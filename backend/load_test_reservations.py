@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Flash-sale load test for checkout holds.
+
+Runs against the Supabase project in .env (needs the inventory hold functions
+from supabase_schema.sql). Hundreds of buyers start checkout at once for a
+product with little stock. Some of the buyers who get a hold abandon it, and
+the buyers who were turned away then retry. Everyone holding stock checks
+out. The run fails if stock was oversold or if a buyer with a hold could not
+check out. Test data is removed at the end.
+
+    python load_test_reservations.py --buyers 300 --stock 40 --abandon 0.25
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from postgrest.exceptions import APIError
+
+from database import async_db
+from utils import generate_order_number
+import inventory
+
+async def timed(coro):
+    started_at = time.perf_counter()
+    try:
+        return await coro, time.perf_counter() - started_at
+    except Exception as e:
+        return e, time.perf_counter() - started_at
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000 if ordered else 0.0
+
+async def checkout(user_id: str):
+    result = await async_db.rpc("create_order_from_cart", {
+        "p_user_id": user_id,
+        "p_order_number": generate_order_number(),
+        "p_details": {}
+    })
+    return result.data["order_id"]
+
+async def run(buyers: int, stock: int, abandon: float, ttl: int):
+    run_id = uuid.uuid4().hex[:8]
+    product_id = str(uuid.uuid4())
+    user_ids = [str(uuid.uuid4()) for _ in range(buyers)]
+
+    await async_db.insert("products", {
+        "id": product_id,
+        "name": f"Flash sale {run_id}",
+        "slug": f"flash-sale-{run_id}",
+        "price": 100,
+        "stock_quantity": stock,
+        "is_active": False
+    })
+    await async_db.insert("users", [{
+        "id": user_id,
+        "email": f"flash-{run_id}-{n}@example.com",
+        "password_hash": "!",
+        "first_name": "Flash",
+        "last_name": str(n)
+    } for n, user_id in enumerate(user_ids)])
+    await async_db.insert("cart_items", [
+        {"user_id": user_id, "product_id": product_id, "quantity": 1}
+        for user_id in user_ids
+    ])
+
+    try:
+        # Wave 1: everyone starts checkout at once
+        wave = await asyncio.gather(*(timed(inventory.reserve_cart(u, ttl)) for u in user_ids))
+        latencies = [latency for _, latency in wave]
+        holders = [u for u, (r, _) in zip(user_ids, wave) if not isinstance(r, Exception)]
+        waiting = [u for u, (r, _) in zip(user_ids, wave) if isinstance(r, inventory.HoldRejected)]
+        failed = [r for r, _ in wave if isinstance(r, Exception) and not isinstance(r, inventory.HoldRejected)]
+        print(f"Wave 1: {len(holders)} holds, {len(waiting)} turned away, {len(failed)} errors")
+
+        # Some holders walk away; the stock goes back to the pool
+        abandoned = random.sample(holders, int(len(holders) * abandon))
+        await asyncio.gather(*(inventory.release_cart(u) for u in abandoned))
+        holders = [u for u in holders if u not in set(abandoned)]
+
+        # Wave 2: the buyers who were turned away retry
+        retry = await asyncio.gather(*(timed(inventory.reserve_cart(u, ttl)) for u in waiting))
+        latencies += [latency for _, latency in retry]
+        second = [u for u, (r, _) in zip(waiting, retry) if not isinstance(r, Exception)]
+        print(f"Abandoned: {len(abandoned)}, wave 2: {len(second)} more holds")
+        holders += second
+
+        # Every holder checks out concurrently; each must succeed
+        orders = await asyncio.gather(*(timed(checkout(u)) for u in holders))
+        placed = [r for r, _ in orders if not isinstance(r, Exception)]
+        lost = [r for r, _ in orders if isinstance(r, Exception)]
+        for e in lost[:5]:
+            print(f"   Checkout with hold failed: {e.message if isinstance(e, APIError) else e}")
+
+        product = await async_db.select("products", columns="stock_quantity", filters={"id": product_id})
+        final_stock = product.data[0]["stock_quantity"]
+
+        print(f"\nBuyers: {buyers}, stock: {stock}")
+        print(f"Orders placed: {len(placed)}, final stock: {final_stock}")
+        print(f"Hold latency p50 {percentile(latencies, 0.5):.1f} ms, "
+              f"p95 {percentile(latencies, 0.95):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms")
+        print(f"Metrics: {inventory.metrics.stats()}")
+
+        ok = (
+            not lost
+            and not failed
+            and final_stock >= 0
+            and final_stock == stock - len(placed)
+            and len(placed) == min(stock, len(holders))
+        )
+        print("✅ Holds never oversold and every holder checked out" if ok else "❌ Hold consistency check failed")
+        return ok
+    finally:
+        # order_items cascade with their orders; holds cascade with users
+        await async_db.execute(async_db.table("orders").delete().in_("user_id", user_ids))
+        await async_db.execute(async_db.table("cart_items").delete().in_("user_id", user_ids))
+        await async_db.execute(async_db.table("users").delete().in_("id", user_ids))
+        await async_db.delete("products", {"id": product_id})
+        await async_db.aclose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=300)
+    parser.add_argument("--stock", type=int, default=40)
+    parser.add_argument("--abandon", type=float, default=0.25, help="share of holders who abandon checkout")
+    parser.add_argument("--ttl", type=int, default=120, help="hold lifetime in seconds")
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args.buyers, args.stock, args.abandon, args.ttl))
+    raise SystemExit(0 if ok else 1)
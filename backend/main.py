@@ -1,19 +1,26 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import uvicorn
+import asyncio
 import os
 from datetime import datetime, timedelta
 from typing import Optional
+from gotrue.errors import AuthApiError
 
-from database import get_supabase_db, SupabaseDB
+from database import get_supabase_db, SupabaseDB, async_db, catalog_cache, count_cache, cart_summary_cache
+import inventory
+from guest_cart import read_guest_cart, clear_guest_cart, merge_guest_cart
 from schemas_supabase import UserCreate, UserLogin, UserResponse, Token, ResponseModel, User
 from auth import (
-    get_password_hash,
-    verify_password,
     create_access_token,
     verify_token,
-    get_current_user
+    get_current_user,
+    get_current_admin_user,
+    get_user_record,
+    start_session,
+    user_cache,
+    session_cache
 )
 
 # Import Supabase routers
@@ -48,6 +55,17 @@ app.include_router(cart.router, prefix="/api")
 app.include_router(orders.router, prefix="/api")
 app.include_router(reviews.router, prefix="/api")
 
+@app.on_event("startup")
+async def start_hold_sweeper():
+    # Expired checkout holds stop counting immediately; this just deletes them
+    app.state.hold_sweeper = asyncio.create_task(inventory.run_hold_sweeper())
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    app.state.hold_sweeper.cancel()
+    # Release pooled PostgREST connections
+    await async_db.aclose()
+
 @app.get("/")
 async def root():
     return {"message": "EcoShop API is running", "version": "1.0.0"}
@@ -56,20 +74,32 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+@app.get("/cache/stats")
+async def cache_stats(current_user: User = Depends(get_current_admin_user)):
+    """Hit/miss counters of the in-process caches (admin only)"""
+    return {
+        "catalog": catalog_cache.stats(),
+        "counts": count_cache.stats(),
+        "cart_summaries": cart_summary_cache.stats(),
+        "users": user_cache.stats(),
+        "sessions": session_cache.stats()
+    }
+
+@app.get("/inventory/metrics")
+async def inventory_metrics(current_user: User = Depends(get_current_admin_user)):
+    """Checkout hold counters and stock contention (admin only)"""
+    return inventory.metrics.stats()
+
 # Authentication endpoints
 @app.post("/auth/register", response_model=ResponseModel)
 async def register(user_data: UserCreate, db: SupabaseDB = Depends(get_supabase_db)):
+    """Register with Supabase Auth; the handle_new_user trigger creates the profile row.
+    
+    One network call. Duplicate emails are rejected by the unique constraints,
+    not a pre-check, and a failed profile insert rolls the auth user back.
+    """
     try:
-        # Check if user already exists
-        existing_user_response = db.supabase.table("users").select("id").eq("email", user_data.email).execute()
-        if existing_user_response.data:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
-            )
-        
-        # Create user in Supabase Auth
-        auth_response = db.supabase.auth.sign_up({
+        auth_response = await asyncio.to_thread(db.supabase.auth.sign_up, {
             "email": user_data.email,
             "password": user_data.password,
             "options": {
@@ -81,36 +111,49 @@ async def register(user_data: UserCreate, db: SupabaseDB = Depends(get_supabase_
             }
         })
         
-        if auth_response.user:
-            # Create user record in database
-            user_record = {
-                "id": auth_response.user.id,
-                "email": user_data.email,
-                "password_hash": get_password_hash(user_data.password),
-                "first_name": user_data.first_name,
-                "last_name": user_data.last_name,
-                "phone": user_data.phone,
-                "is_admin": user_data.is_admin,
-                "is_active": user_data.is_active
-            }
-            
-            db_result = db.supabase.table("users").insert(user_record).execute()
-            
-            return ResponseModel(
-                success=True,
-                message="User registered successfully",
-                data={
-                    "user_id": auth_response.user.id,
-                    "email": user_data.email,
-                    "confirmation_sent": True
-                }
+        # With email confirmation on, Supabase answers a repeat sign-up with an
+        # obfuscated user that has no identities instead of an error
+        if auth_response.user and auth_response.user.identities == []:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered"
             )
-        else:
+        
+        if not auth_response.user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to create user"
             )
-            
+        
+        return ResponseModel(
+            success=True,
+            message="User registered successfully",
+            data={
+                "user_id": auth_response.user.id,
+                "email": user_data.email,
+                "confirmation_sent": auth_response.session is None
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except AuthApiError as e:
+        if e.code in ("user_already_exists", "email_exists") or "already registered" in e.message:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered"
+            )
+        if e.status >= 500:
+            # e.g. "Database error saving new user": any handle_new_user failure
+            print(f"Registration failed for {user_data.email}: {e.status} {e.code} {e.message}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Registration failed, please try again later"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Registration failed: {e.message}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -118,45 +161,51 @@ async def register(user_data: UserCreate, db: SupabaseDB = Depends(get_supabase_
         )
 
 @app.post("/auth/login", response_model=Token)
-async def login(user_credentials: UserLogin, db: SupabaseDB = Depends(get_supabase_db)):
+async def login(
+    user_credentials: UserLogin,
+    request: Request,
+    response: Response,
+    db: SupabaseDB = Depends(get_supabase_db)
+):
     try:
         # Authenticate with Supabase
-        auth_response = db.supabase.auth.sign_in_with_password({
+        auth_response = await asyncio.to_thread(db.supabase.auth.sign_in_with_password, {
             "email": user_credentials.email,
             "password": user_credentials.password
         })
         
         if auth_response.user and auth_response.session:
-            # Get user data from database
-            user_data_response = db.supabase.table("users").select("*").eq("id", auth_response.user.id).execute()
+            # Profile columns only, served from the user cache on repeat logins
+            user = await asyncio.to_thread(get_user_record, str(auth_response.user.id))
             
-            if not user_data_response.data:
+            if user is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="User not found"
                 )
             
-            user = user_data_response.data[0]
-            
             if not user.get("is_active", True):
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="Account is deactivated"
                 )
             
+            # Carry over anything added to the cart before signing in
+            guest_items = read_guest_cart(request)
+            if guest_items:
+                try:
+                    await merge_guest_cart(user["id"], guest_items)
+                    clear_guest_cart(response)
+                except Exception as e:
+                    print(f"Guest cart merge failed: {e}")
+            
+            # Requests made with this token, /auth/me included, skip verification and lookup
+            start_session(auth_response.session.access_token, user, auth_response.session.expires_at)
+            
             return Token(
                 access_token=auth_response.session.access_token,
                 token_type="bearer",
-                user=UserResponse(
-                    id=user["id"],
-                    email=user["email"],
-                    first_name=user["first_name"],
-                    last_name=user["last_name"],
-                    phone=user.get("phone"),
-                    is_admin=user.get("is_admin", False),
-                    is_active=user.get("is_active", True),
-                    created_at=user["created_at"]
-                )
+                user=UserResponse(**user)
             )
         else:
             raise HTTPException(
@@ -170,17 +219,9 @@ async def login(user_credentials: UserLogin, db: SupabaseDB = Depends(get_supaba
             detail="Authentication failed"
         )
 @app.get("/auth/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
-    return UserResponse(
-        id=current_user.id,
-        email=current_user.email,
-        first_name=current_user.first_name,
-        last_name=current_user.last_name,
-        phone=current_user.phone,
-        is_admin=current_user.is_admin,
-        is_active=current_user.is_active,
-        created_at=current_user.created_at
-    )
+async def get_current_user_info(current_user: dict = Depends(get_current_user)):
+    # Served from the session cache populated at login
+    return UserResponse(**current_user)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
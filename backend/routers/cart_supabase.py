@@ -1,24 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from typing import Dict, List
 from uuid import UUID
 
-from database import get_supabase_db, SupabaseDB
-from schemas_supabase import CartItemResponse, CartItemCreate, User
+from postgrest.exceptions import APIError
+
+from database import get_async_db, AsyncSupabaseDB, cart_summary_cache
+from schemas_supabase import CartItemResponse, CartItemCreate, GuestCartItem, User
 from auth import get_current_user
+from guest_cart import (
+    read_guest_cart, write_guest_cart, clear_guest_cart, merge_guest_cart,
+    GUEST_CART_MAX_ITEMS, GUEST_CART_MAX_QUANTITY
+)
 
 router = APIRouter(prefix="/cart", tags=["cart"])
 
+# SQLSTATEs raised by add_to_cart(): RAISE EXCEPTION and no_data_found
+CART_ERROR_CODE = "P0001"
+NOT_FOUND_ERROR_CODE = "P0002"
+
+GUEST_PRODUCT_COLUMNS = "id, name, price, image_url, stock_quantity, is_active"
+
 @router.get("/", response_model=List[CartItemResponse])
 async def get_cart_items(
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Get current user's cart items."""
     try:
-        response = db.supabase.table("cart_items").select("""
+        response = await db.execute(db.table("cart_items").select("""
             *,
             product:products(id, name, price, image_url, stock_quantity, is_active)
-        """).eq("user_id", current_user.id).execute()
+        """).eq("user_id", current_user["id"]))
         
         return response.data if response.data else []
         
@@ -31,22 +43,94 @@ async def get_cart_items(
 @router.post("/", response_model=CartItemResponse)
 async def add_to_cart(
     item_data: CartItemCreate,
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
-    """Add item to cart or update quantity if exists."""
+    """Add item to cart or update quantity if exists.
+    
+    One add_to_cart() call validates the product and stock, upserts on
+    (user_id, product_id) and returns the row with its product.
+    """
     try:
-        # Validate product ID format
-        try:
-            UUID(item_data.product_id)
-        except ValueError:
+        response = await db.rpc("add_to_cart", {
+            "p_user_id": current_user["id"],
+            "p_product_id": str(item_data.product_id),
+            "p_quantity": item_data.quantity
+        })
+        cart_summary_cache.pop(current_user["id"])
+        
+        return response.data
+        
+    except APIError as e:
+        if e.code == NOT_FOUND_ERROR_CODE:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=e.message
+            )
+        if e.code == CART_ERROR_CODE:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=e.message
+            )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error adding item to cart: {e.message}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error adding item to cart: {str(e)}"
+        )
+
+async def guest_cart_payload(db: AsyncSupabaseDB, items: Dict[str, int], token: str = None) -> dict:
+    """Guest cart contents with product details, loaded in one query."""
+    products = await db.batch_load("products", "id", items.keys(), columns=GUEST_PRODUCT_COLUMNS)
+    lines = [
+        {"product_id": product_id, "quantity": quantity, "product": products[product_id]}
+        for product_id, quantity in items.items()
+        if product_id in products and products[product_id]["is_active"]
+    ]
+    return {
+        "items": lines,
+        "count": sum(line["quantity"] for line in lines),
+        "subtotal": float(sum(float(line["product"]["price"]) * line["quantity"] for line in lines)),
+        "token": token
+    }
+
+# Guest cart: no auth and no database writes; the cart travels in a signed cookie.
+# These routes are declared before /{item_id} so "guest" is not taken for an item id.
+@router.get("/guest")
+async def get_guest_cart(request: Request, db: AsyncSupabaseDB = Depends(get_async_db)):
+    """Get the anonymous cart carried by the request."""
+    try:
+        return await guest_cart_payload(db, read_guest_cart(request))
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching guest cart: {str(e)}"
+        )
+
+@router.post("/guest")
+async def add_to_guest_cart(
+    item_data: GuestCartItem,
+    request: Request,
+    response: Response,
+    db: AsyncSupabaseDB = Depends(get_async_db)
+):
+    """Add item to the anonymous cart or increase its quantity."""
+    try:
+        items = read_guest_cart(request)
+        product_id = str(item_data.product_id)
+        quantity = items.get(product_id, 0) + item_data.quantity
+        
+        if product_id not in items and len(items) >= GUEST_CART_MAX_ITEMS:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid product ID format"
+                detail="Guest cart is full, please sign in"
             )
         
-        # Check if product exists and is active
-        product_response = db.supabase.table("products").select("id, stock_quantity, is_active").eq("id", item_data.product_id).eq("is_active", True).execute()
+        product_response = await db.execute(db.table("products").select("id, stock_quantity").eq("id", product_id).eq("is_active", True))
         
         if not product_response.data:
             raise HTTPException(
@@ -54,84 +138,120 @@ async def add_to_cart(
                 detail="Product not found"
             )
         
-        product = product_response.data[0]
-        
-        # Check stock availability
-        if product["stock_quantity"] < item_data.quantity:
+        if product_response.data[0]["stock_quantity"] < quantity or quantity > GUEST_CART_MAX_QUANTITY:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Insufficient stock"
             )
         
-        # Check if item already in cart
-        existing_item_response = db.supabase.table("cart_items").select("*").eq("user_id", current_user.id).eq("product_id", item_data.product_id).execute()
-        
-        if existing_item_response.data:
-            # Update quantity
-            existing_item = existing_item_response.data[0]
-            new_quantity = existing_item["quantity"] + item_data.quantity
-            
-            if product["stock_quantity"] < new_quantity:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Insufficient stock"
-                )
-            
-            update_response = db.supabase.table("cart_items").update({
-                "quantity": new_quantity
-            }).eq("id", existing_item["id"]).execute()
-            
-            if not update_response.data:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to update cart item"
-                )
-            
-            # Get updated item with product details
-            updated_item_response = db.supabase.table("cart_items").select("""
-                *,
-                product:products(id, name, price, image_url, stock_quantity, is_active)
-            """).eq("id", existing_item["id"]).execute()
-            
-            return updated_item_response.data[0]
+        items[product_id] = quantity
+        token = write_guest_cart(response, items)
+        
+        return await guest_cart_payload(db, items, token)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error adding item to guest cart: {str(e)}"
+        )
+
+@router.put("/guest/{product_id}")
+async def update_guest_cart_item(
+    product_id: UUID,
+    quantity: int,
+    request: Request,
+    response: Response,
+    db: AsyncSupabaseDB = Depends(get_async_db)
+):
+    """Set the quantity of an item in the anonymous cart; 0 removes it."""
+    try:
+        if quantity < 0 or quantity > GUEST_CART_MAX_QUANTITY:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Quantity must be between 0 and {GUEST_CART_MAX_QUANTITY}"
+            )
+        
+        items = read_guest_cart(request)
+        if str(product_id) not in items:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Cart item not found"
+            )
+        
+        if quantity:
+            items[str(product_id)] = quantity
         else:
-            # Create new cart item
-            cart_item_data = {
-                "user_id": current_user.id,
-                "product_id": item_data.product_id,
-                "quantity": item_data.quantity
-            }
-            
-            insert_response = db.supabase.table("cart_items").insert(cart_item_data).execute()
-            
-            if not insert_response.data:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to add item to cart"
-                )
-            
-            # Get created item with product details
-            created_item_response = db.supabase.table("cart_items").select("""
-                *,
-                product:products(id, name, price, image_url, stock_quantity, is_active)
-            """).eq("id", insert_response.data[0]["id"]).execute()
-            
-            return created_item_response.data[0]
-            
+            del items[str(product_id)]
+        token = write_guest_cart(response, items)
+        
+        return await guest_cart_payload(db, items, token)
+        
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error adding item to cart: {str(e)}"
+            detail=f"Error updating guest cart: {str(e)}"
+        )
+
+@router.delete("/guest/{product_id}")
+async def remove_from_guest_cart(
+    product_id: UUID,
+    request: Request,
+    response: Response,
+    db: AsyncSupabaseDB = Depends(get_async_db)
+):
+    """Remove an item from the anonymous cart."""
+    try:
+        items = read_guest_cart(request)
+        items.pop(str(product_id), None)
+        token = write_guest_cart(response, items)
+        
+        return await guest_cart_payload(db, items, token)
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error removing item from guest cart: {str(e)}"
+        )
+
+@router.delete("/guest")
+async def clear_guest_cart_items(response: Response):
+    """Discard the anonymous cart."""
+    clear_guest_cart(response)
+    return {"success": True, "message": "Guest cart cleared"}
+
+@router.post("/guest/merge")
+async def merge_guest_cart_items(
+    request: Request,
+    response: Response,
+    current_user: dict = Depends(get_current_user)
+):
+    """Move the anonymous cart into the signed-in user's cart (one bulk upsert).
+    
+    /auth/login does this automatically; this is for clients that sign in
+    with Supabase directly.
+    """
+    try:
+        merged = await merge_guest_cart(current_user["id"], read_guest_cart(request))
+        clear_guest_cart(response)
+        
+        return {"success": True, "message": "Guest cart merged", "merged": merged}
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error merging guest cart: {str(e)}"
         )
 
 @router.put("/{item_id}")
 async def update_cart_item(
     item_id: str,
     quantity: int,
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Update cart item quantity."""
     try:
@@ -152,7 +272,7 @@ async def update_cart_item(
             )
         
         # Check if cart item exists and belongs to current user
-        cart_item_response = db.supabase.table("cart_items").select("*, product:products(stock_quantity)").eq("id", item_id).eq("user_id", current_user.id).execute()
+        cart_item_response = await db.execute(db.table("cart_items").select("*, product:products(stock_quantity)").eq("id", item_id).eq("user_id", current_user["id"]))
         
         if not cart_item_response.data:
             raise HTTPException(
@@ -162,17 +282,21 @@ async def update_cart_item(
         
         cart_item = cart_item_response.data[0]
         
-        # Check stock availability
-        if cart_item["product"]["stock_quantity"] < quantity:
+        # Check stock availability; units other checkouts hold are not available
+        held = await db.rpc("held_quantity", {
+            "p_product_id": cart_item["product_id"],
+            "p_exclude_user_id": current_user["id"]
+        })
+        if (cart_item["product"]["stock_quantity"] or 0) - (held.data or 0) < quantity:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Insufficient stock"
             )
         
         # Update quantity
-        update_response = db.supabase.table("cart_items").update({
+        update_response = await db.execute(db.table("cart_items").update({
             "quantity": quantity
-        }).eq("id", item_id).execute()
+        }).eq("id", item_id))
         
         if not update_response.data:
             raise HTTPException(
@@ -180,6 +304,8 @@ async def update_cart_item(
                 detail="Failed to update cart item"
             )
         
+        cart_summary_cache.pop(current_user["id"])
+        
         return {"success": True, "message": "Cart item updated"}
         
     except HTTPException:
@@ -193,8 +319,8 @@ async def update_cart_item(
 @router.delete("/{item_id}")
 async def remove_from_cart(
     item_id: str,
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Remove item from cart."""
     try:
@@ -208,7 +334,7 @@ async def remove_from_cart(
             )
         
         # Check if cart item exists and belongs to current user
-        cart_item_response = db.supabase.table("cart_items").select("id").eq("id", item_id).eq("user_id", current_user.id).execute()
+        cart_item_response = await db.execute(db.table("cart_items").select("id").eq("id", item_id).eq("user_id", current_user["id"]))
         
         if not cart_item_response.data:
             raise HTTPException(
@@ -217,7 +343,7 @@ async def remove_from_cart(
             )
         
         # Delete cart item
-        delete_response = db.supabase.table("cart_items").delete().eq("id", item_id).execute()
+        delete_response = await db.execute(db.table("cart_items").delete().eq("id", item_id))
         
         if not delete_response.data:
             raise HTTPException(
@@ -225,6 +351,8 @@ async def remove_from_cart(
                 detail="Failed to remove item from cart"
             )
         
+        cart_summary_cache.pop(current_user["id"])
+        
         return {"success": True, "message": "Item removed from cart"}
         
     except HTTPException:
@@ -237,13 +365,15 @@ async def remove_from_cart(
 
 @router.delete("/")
 async def clear_cart(
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Clear all items from cart."""
     try:
         # Delete all cart items for current user
-        delete_response = db.supabase.table("cart_items").delete().eq("user_id", current_user.id).execute()
+        delete_response = await db.execute(db.table("cart_items").delete().eq("user_id", current_user["id"]))
+        
+        cart_summary_cache.pop(current_user["id"])
         
         return {"success": True, "message": "Cart cleared"}
         
@@ -255,16 +385,25 @@ async def clear_cart(
 
 @router.get("/count")
 async def get_cart_count(
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
-    """Get total number of items in cart."""
+    """Get total number of items in cart, plus the cart subtotal.
+    
+    Served from a per-user cache that cart writes invalidate; a miss costs one
+    aggregate query.
+    """
     try:
-        response = db.supabase.table("cart_items").select("quantity").eq("user_id", current_user.id).execute()
-        
-        total_items = sum(item["quantity"] for item in response.data) if response.data else 0
+        summary = cart_summary_cache.get(current_user["id"])
+        if summary is None:
+            response = await db.rpc("cart_summary", {"p_user_id": current_user["id"]})
+            summary = {
+                "count": int(response.data["count"]),
+                "subtotal": float(response.data["subtotal"])
+            }
+            cart_summary_cache.set(current_user["id"], summary)
         
-        return {"count": total_items}
+        return summary
         
     except Exception as e:
         raise HTTPException(
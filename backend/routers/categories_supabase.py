@@ -2,19 +2,26 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from uuid import UUID
 
-from database import get_supabase_db, SupabaseDB
+from database import get_async_db, AsyncSupabaseDB, catalog_cache
 from schemas_supabase import CategoryResponse, CategoryCreate, User
 from auth import get_current_admin_user
 
 router = APIRouter(prefix="/categories", tags=["categories"])
 
 @router.get("/", response_model=List[CategoryResponse])
-async def get_categories(db: SupabaseDB = Depends(get_supabase_db)):
+async def get_categories(db: AsyncSupabaseDB = Depends(get_async_db)):
     """Get all active categories."""
     try:
-        response = db.supabase.table("categories").select("*").eq("is_active", True).order("name").execute()
+        cache_key = catalog_cache.key("categories", view="list")
+        cached = catalog_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        return response.data if response.data else []
+        response = await db.execute(db.table("categories").select("*").eq("is_active", True).order("name"))
+        
+        categories = response.data if response.data else []
+        catalog_cache.set(cache_key, categories)
+        return categories
         
     except Exception as e:
         raise HTTPException(
@@ -25,7 +32,7 @@ async def get_categories(db: SupabaseDB = Depends(get_supabase_db)):
 @router.get("/{category_id}", response_model=CategoryResponse)
 async def get_category(
     category_id: str,
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Get a single category by ID."""
     try:
@@ -38,7 +45,12 @@ async def get_category(
                 detail="Invalid category ID format"
             )
         
-        response = db.supabase.table("categories").select("*").eq("id", category_id).eq("is_active", True).execute()
+        cache_key = catalog_cache.key("categories", view="id", id=category_id)
+        cached = catalog_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        response = await db.execute(db.table("categories").select("*").eq("id", category_id).eq("is_active", True))
         
         if not response.data:
             raise HTTPException(
@@ -46,6 +58,7 @@ async def get_category(
                 detail="Category not found"
             )
         
+        catalog_cache.set(cache_key, response.data[0])
         return response.data[0]
         
     except HTTPException:
@@ -59,11 +72,16 @@ async def get_category(
 @router.get("/slug/{slug}", response_model=CategoryResponse)
 async def get_category_by_slug(
     slug: str,
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Get a single category by slug."""
     try:
-        response = db.supabase.table("categories").select("*").eq("slug", slug).eq("is_active", True).execute()
+        cache_key = catalog_cache.key("categories", view="slug", slug=slug)
+        cached = catalog_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        response = await db.execute(db.table("categories").select("*").eq("slug", slug).eq("is_active", True))
         
         if not response.data:
             raise HTTPException(
@@ -71,6 +89,7 @@ async def get_category_by_slug(
                 detail="Category not found"
             )
         
+        catalog_cache.set(cache_key, response.data[0])
         return response.data[0]
         
     except HTTPException:
@@ -85,12 +104,12 @@ async def get_category_by_slug(
 async def create_category(
     category_data: CategoryCreate,
     current_user: User = Depends(get_current_admin_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Create a new category (admin only)."""
     try:
         # Check if slug already exists
-        existing_slug = db.supabase.table("categories").select("id").eq("slug", category_data.slug).execute()
+        existing_slug = await db.execute(db.table("categories").select("id").eq("slug", category_data.slug))
         if existing_slug.data:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -100,7 +119,7 @@ async def create_category(
         # Create category
         category_dict = category_data.dict()
         
-        response = db.supabase.table("categories").insert(category_dict).execute()
+        response = await db.execute(db.table("categories").insert(category_dict))
         
         if not response.data:
             raise HTTPException(
@@ -108,6 +127,9 @@ async def create_category(
                 detail="Failed to create category"
             )
         
+        # Products embed their category
+        catalog_cache.bump("categories", "products")
+        
         return response.data[0]
         
     except HTTPException:
@@ -123,7 +145,7 @@ async def update_category(
     category_id: str,
     category_data: CategoryCreate,
     current_user: User = Depends(get_current_admin_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Update a category (admin only)."""
     try:
@@ -137,7 +159,7 @@ async def update_category(
             )
         
         # Check if category exists
-        existing_category = db.supabase.table("categories").select("id").eq("id", category_id).execute()
+        existing_category = await db.execute(db.table("categories").select("id").eq("id", category_id))
         if not existing_category.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -147,7 +169,7 @@ async def update_category(
         # Update category
         update_data = category_data.dict(exclude_unset=True)
         
-        response = db.supabase.table("categories").update(update_data).eq("id", category_id).execute()
+        response = await db.execute(db.table("categories").update(update_data).eq("id", category_id))
         
         if not response.data:
             raise HTTPException(
@@ -155,6 +177,9 @@ async def update_category(
                 detail="Failed to update category"
             )
         
+        # Products embed their category
+        catalog_cache.bump("categories", "products")
+        
         return response.data[0]
         
     except HTTPException:
@@ -169,7 +194,7 @@ async def update_category(
 async def delete_category(
     category_id: str,
     current_user: User = Depends(get_current_admin_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Soft delete a category (admin only)."""
     try:
@@ -183,7 +208,7 @@ async def delete_category(
             )
         
         # Check if category exists
-        existing_category = db.supabase.table("categories").select("id").eq("id", category_id).execute()
+        existing_category = await db.execute(db.table("categories").select("id").eq("id", category_id))
         if not existing_category.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -191,7 +216,7 @@ async def delete_category(
             )
         
         # Soft delete (set is_active to False)
-        response = db.supabase.table("categories").update({"is_active": False}).eq("id", category_id).execute()
+        response = await db.execute(db.table("categories").update({"is_active": False}).eq("id", category_id))
         
         if not response.data:
             raise HTTPException(
@@ -199,6 +224,9 @@ async def delete_category(
                 detail="Failed to delete category"
             )
         
+        # Products embed their category
+        catalog_cache.bump("categories", "products")
+        
         return {"success": True, "message": "Category deleted successfully"}
         
     except HTTPException:
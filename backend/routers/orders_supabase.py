@@ -1,27 +1,37 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional, Dict, Any
+from typing import Optional
 from datetime import datetime
-from uuid import UUID, uuid4
-from decimal import Decimal
+from uuid import UUID
+import asyncio
 
-from database import get_db, db
-from schemas_supabase import OrderResponse, OrderCreate, OrderUpdate, ResponseModel, PaginatedResponse
+from postgrest.exceptions import APIError
+
+from database import async_db as db, InvalidCursorError, cart_summary_cache
+from schemas_supabase import OrderResponse, OrderCreate, OrderUpdate, ResponseModel, PaginatedResponse, table_columns
 from auth import get_current_user, get_current_admin_user
-from utils import calculate_order_totals
+from utils import generate_order_number
+from inventory import reserve_cart, release_cart, HoldRejected
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
-def generate_order_number() -> str:
-    """Generate a unique order number."""
-    import time
-    timestamp = str(int(time.time()))
-    return f"ORD-{timestamp}"
+# Newest first; id breaks ties so keyset cursors are stable
+ORDER_ORDERING = [("created_at", True), ("id", True)]
+
+# Orders are returned as stored, so their projections are the table columns
+ORDER_COLUMNS = table_columns("orders")
+ORDER_ITEM_COLUMNS = table_columns("order_items")
+ORDER_USER_COLUMNS = "id, email, first_name, last_name"
+
+# SQLSTATE of a plain RAISE EXCEPTION in the order functions; carries a user-facing message
+ORDER_ERROR_CODE = "P0001"
 
 @router.get("/", response_model=PaginatedResponse)
 async def get_orders(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=50),
-    status: Optional[str] = None,
+    order_status: Optional[str] = Query(None, alias="status"),
+    pagination: str = Query("offset", pattern="^(offset|cursor)$"),
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """Get current user's orders."""
@@ -29,34 +39,35 @@ async def get_orders(
     try:
         # Build filters
         filters = {"user_id": current_user["id"]}
-        if status:
-            filters["status"] = status
-        
-        # Get total count
-        total_result = db.select("orders", columns="count(*)", filters=filters)
-        total = total_result.data[0]["count"] if total_result.data else 0
+        if order_status:
+            filters["status"] = order_status
+        
+        # Get paginated orders with their total count
+        orders, meta = await db.paginate(
+            db.table("orders").select(ORDER_COLUMNS).match(filters),
+            ORDER_ORDERING,
+            limit=limit,
+            page=page,
+            use_cursor=pagination == "cursor",
+            cursor=cursor,
+            sort="orders",
+            count_key=("orders", tuple(sorted(filters.items()))),
+            count_query=db.table("orders").select("id").match(filters)
+        )
         
-        # Get paginated orders
-        offset = (page - 1) * limit
-        orders_result = db.client.table("orders").select("*").match(filters).order("created_at", desc=True).range(offset, offset + limit - 1).execute()
+        # Get order items for the whole page in one query
+        items_by_order = await db.batch_load("order_items", "order_id", [order["id"] for order in orders],
+                                        columns=ORDER_ITEM_COLUMNS, many=True)
+        for order in orders:
+            order["items"] = items_by_order.get(str(order["id"]), [])
         
-        orders = orders_result.data if orders_result.data else []
+        return PaginatedResponse(data=orders, meta=meta)
         
-        # Get order items for each order
-        for order in orders:
-            items_result = db.select("order_items", filters={"order_id": order["id"]})
-            order["items"] = items_result.data if items_result.data else []
-        
-        return PaginatedResponse(
-            data=orders,
-            meta={
-                "page": page,
-                "per_page": limit,
-                "total": total,
-                "pages": (total + limit - 1) // limit
-            }
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
         )
-        
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -67,8 +78,10 @@ async def get_orders(
 async def get_all_orders(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=50),
-    status: Optional[str] = None,
+    order_status: Optional[str] = Query(None, alias="status"),
     user_id: Optional[UUID] = None,
+    pagination: str = Query("offset", pattern="^(offset|cursor)$"),
+    cursor: Optional[str] = None,
     current_admin: dict = Depends(get_current_admin_user)
 ):
     """Get all orders (admin only)."""
@@ -76,56 +89,99 @@ async def get_all_orders(
     try:
         # Build filters
         filters = {}
-        if status:
-            filters["status"] = status
+        if order_status:
+            filters["status"] = order_status
         if user_id:
             filters["user_id"] = str(user_id)
         
-        # Get total count
-        if filters:
-            total_result = db.client.table("orders").select("count(*)", count="exact").match(filters).execute()
-        else:
-            total_result = db.client.table("orders").select("count(*)", count="exact").execute()
+        def build_query(columns: str):
+            # match() rejects an empty filter set
+            query = db.table("orders").select(columns)
+            return query.match(filters) if filters else query
+        
+        # Get paginated orders with their total count
+        orders, meta = await db.paginate(
+            build_query(ORDER_COLUMNS),
+            ORDER_ORDERING,
+            limit=limit,
+            page=page,
+            use_cursor=pagination == "cursor",
+            cursor=cursor,
+            sort="orders",
+            count_key=("orders", tuple(sorted(filters.items()))),
+            count_query=build_query("id")
+        )
         
-        total = total_result.count if hasattr(total_result, 'count') else 0
+        # Get order items and user info for the whole page, one query each
+        items_by_order, users_by_id = await asyncio.gather(
+            db.batch_load("order_items", "order_id", [order["id"] for order in orders],
+                          columns=ORDER_ITEM_COLUMNS, many=True),
+            db.batch_load("users", "id", [order.get("user_id") for order in orders],
+                          columns=ORDER_USER_COLUMNS)
+        )
+        for order in orders:
+            order["items"] = items_by_order.get(str(order["id"]), [])
+            if order.get("user_id"):
+                order["user"] = users_by_id.get(str(order["user_id"]))
         
-        # Get paginated orders
-        offset = (page - 1) * limit
-        query = db.client.table("orders").select("*")
+        return PaginatedResponse(data=orders, meta=meta)
         
-        if filters:
-            query = query.match(filters)
-            
-        orders_result = query.order("created_at", desc=True).range(offset, offset + limit - 1).execute()
-        orders = orders_result.data if orders_result.data else []
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to fetch orders: {str(e)}"
+        )
+
+@router.post("/reserve", response_model=ResponseModel)
+async def reserve_checkout(current_user: dict = Depends(get_current_user)):
+    """Hold the stock in the current user's cart while they complete checkout.
+    
+    Calling again refreshes the hold to match the current cart. Placing the
+    order consumes the hold; otherwise it expires after HOLD_TTL_SECONDS.
+    """
+    
+    try:
+        hold = await reserve_cart(current_user["id"])
         
-        # Get order items and user info for each order
-        for order in orders:
-            # Get order items
-            items_result = db.select("order_items", filters={"order_id": order["id"]})
-            order["items"] = items_result.data if items_result.data else []
-            
-            # Get user info
-            if order.get("user_id"):
-                user_result = db.select("users", 
-                                      columns="id,email,first_name,last_name", 
-                                      filters={"id": order["user_id"]})
-                order["user"] = user_result.data[0] if user_result.data else None
-        
-        return PaginatedResponse(
-            data=orders,
-            meta={
-                "page": page,
-                "per_page": limit,
-                "total": total,
-                "pages": (total + limit - 1) // limit
-            }
+        return ResponseModel(
+            success=True,
+            message="Cart reserved",
+            data=hold
         )
         
+    except HoldRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=e.message
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to fetch orders: {str(e)}"
+            detail=f"Failed to reserve cart: {str(e)}"
+        )
+
+@router.delete("/reserve", response_model=ResponseModel)
+async def release_checkout(current_user: dict = Depends(get_current_user)):
+    """Release the current user's checkout hold."""
+    
+    try:
+        released = await release_cart(current_user["id"])
+        
+        return ResponseModel(
+            success=True,
+            message="Reservation released",
+            data={"released": released}
+        )
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to release reservation: {str(e)}"
         )
 
 @router.get("/{order_id}", response_model=ResponseModel)
@@ -137,7 +193,7 @@ async def get_order(
     
     try:
         # Get order
-        order_result = db.select("orders", filters={"id": str(order_id)})
+        order_result = await db.select("orders", columns=ORDER_COLUMNS, filters={"id": str(order_id)})
         
         if not order_result.data:
             raise HTTPException(
@@ -155,7 +211,7 @@ async def get_order(
             )
         
         # Get order items
-        items_result = db.select("order_items", filters={"order_id": str(order_id)})
+        items_result = await db.select("order_items", columns=ORDER_ITEM_COLUMNS, filters={"order_id": str(order_id)})
         order["items"] = items_result.data if items_result.data else []
         
         return ResponseModel(
@@ -177,117 +233,47 @@ async def create_order(
     order_data: OrderCreate,
     current_user: dict = Depends(get_current_user)
 ):
-    """Create a new order from cart."""
+    """Create a new order from cart.
+    
+    Checkout runs as one transaction in create_order_from_cart(): stock is
+    validated under row locks, so concurrent checkouts cannot oversell.
+    """
     
     try:
-        # Get user's cart items
-        cart_result = db.select("cart_items", filters={"user_id": current_user["id"]})
-        
-        if not cart_result.data:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Cart is empty"
-            )
-        
-        cart_items = cart_result.data
-        
-        # Calculate order totals
-        subtotal = 0
-        order_items = []
-        
-        for cart_item in cart_items:
-            # Get product details
-            product_result = db.select("products", filters={"id": cart_item["product_id"]})
-            if not product_result.data:
-                continue
-                
-            product = product_result.data[0]
-            
-            # Check stock
-            if product["stock_quantity"] < cart_item["quantity"]:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Insufficient stock for product: {product['name']}"
-                )
-            
-            item_total = Decimal(str(product["price"])) * cart_item["quantity"]
-            subtotal += item_total
-            
-            order_items.append({
-                "product_id": cart_item["product_id"],
-                "product_name": product["name"],
-                "product_sku": product.get("sku"),
-                "quantity": cart_item["quantity"],
-                "unit_price": Decimal(str(product["price"])),
-                "total_price": item_total
-            })
-        
-        # Calculate shipping and tax
-        shipping_amount = 830 if subtotal < 8300 else 0  # Free shipping over ₹8,300
-        tax_amount = subtotal * Decimal("0.08")  # 8% tax
-        total_amount = subtotal + shipping_amount + tax_amount
-        
-        # Create order
-        order_id = uuid4()
-        order_number = generate_order_number()
-        
-        order_record = {
-            "id": str(order_id),
-            "user_id": current_user["id"],
-            "order_number": order_number,
-            "status": "pending",
-            "payment_status": "pending",
-            "subtotal": float(subtotal),
-            "tax_amount": float(tax_amount),
-            "shipping_amount": float(shipping_amount),
-            "total_amount": float(total_amount),
-            "currency": "INR",
-            **order_data.model_dump(exclude_unset=True)
-        }
-        
-        # Insert order
-        order_result = db.insert("orders", order_record)
-        
-        if not order_result.data:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to create order"
-            )
-        
-        # Insert order items
-        for item in order_items:
-            item["id"] = str(uuid4())
-            item["order_id"] = str(order_id)
-            item["unit_price"] = float(item["unit_price"])
-            item["total_price"] = float(item["total_price"])
-            
-            db.insert("order_items", item)
-        
-        # Update product stock
-        for cart_item in cart_items:
-            product_result = db.select("products", filters={"id": cart_item["product_id"]})
-            if product_result.data:
-                product = product_result.data[0]
-                new_stock = product["stock_quantity"] - cart_item["quantity"]
-                db.update("products", 
-                         {"stock_quantity": new_stock}, 
-                         {"id": cart_item["product_id"]})
-        
-        # Clear cart
-        db.delete("cart_items", {"user_id": current_user["id"]})
+        # Totals, status and ownership are computed server-side; only the
+        # customer-supplied details (addresses, notes, payment method) are passed
+        details = order_data.model_dump(mode="json", exclude_unset=True, exclude={"items"})
+        
+        result = await db.rpc("create_order_from_cart", {
+            "p_user_id": current_user["id"],
+            "p_order_number": generate_order_number(),
+            "p_details": details
+        })
+        order = result.data
+        # Checkout emptied the cart
+        cart_summary_cache.pop(current_user["id"])
         
         return ResponseModel(
             success=True,
             message="Order created successfully",
             data={
-                "order_id": str(order_id),
-                "order_number": order_number,
-                "total_amount": float(total_amount)
+                "order_id": order["order_id"],
+                "order_number": order["order_number"],
+                "total_amount": float(order["total_amount"])
             }
         )
         
-    except HTTPException:
-        raise
+    except APIError as e:
+        if e.code == ORDER_ERROR_CODE:
+            # Empty cart or insufficient stock
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=e.message
+            )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create order: {e.message}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -304,7 +290,7 @@ async def update_order_status(
     
     try:
         # Check if order exists
-        order_result = db.select("orders", filters={"id": str(order_id)})
+        order_result = await db.select("orders", columns="id", filters={"id": str(order_id)})
         
         if not order_result.data:
             raise HTTPException(
@@ -321,7 +307,7 @@ async def update_order_status(
         elif order_update.status == "delivered" and "delivered_at" not in update_data:
             update_data["delivered_at"] = datetime.utcnow().isoformat()
         
-        result = db.update("orders", update_data, {"id": str(order_id)})
+        result = await db.update("orders", update_data, {"id": str(order_id)})
         
         if not result.data:
             raise HTTPException(
@@ -352,7 +338,7 @@ async def cancel_order(
     
     try:
         # Get order
-        order_result = db.select("orders", filters={"id": str(order_id)})
+        order_result = await db.select("orders", columns="id, user_id, status", filters={"id": str(order_id)})
         
         if not order_result.data:
             raise HTTPException(
@@ -376,23 +362,8 @@ async def cancel_order(
                 detail="Order cannot be cancelled"
             )
         
-        # Update order status to cancelled
-        result = db.update("orders", 
-                          {"status": "cancelled"}, 
-                          {"id": str(order_id)})
-        
-        # Restore product stock
-        items_result = db.select("order_items", filters={"order_id": str(order_id)})
-        
-        for item in items_result.data:
-            if item.get("product_id"):
-                product_result = db.select("products", filters={"id": item["product_id"]})
-                if product_result.data:
-                    product = product_result.data[0]
-                    new_stock = product["stock_quantity"] + item["quantity"]
-                    db.update("products", 
-                             {"stock_quantity": new_stock}, 
-                             {"id": item["product_id"]})
+        # Cancel and restore stock for all items in one transaction
+        await db.rpc("cancel_order_and_restock", {"p_order_id": str(order_id)})
         
         return ResponseModel(
             success=True,
@@ -402,6 +373,17 @@ async def cancel_order(
         
     except HTTPException:
         raise
+    except APIError as e:
+        if e.code == ORDER_ERROR_CODE:
+            # Cancelled or shipped concurrently since the status check above
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=e.message
+            )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to cancel order: {e.message}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
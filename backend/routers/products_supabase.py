@@ -2,145 +2,146 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
 from uuid import UUID
 
-from database import get_supabase_db, SupabaseDB
+from database import get_async_db, AsyncSupabaseDB, InvalidCursorError, catalog_cache
 from schemas_supabase import (
-    ProductResponse, ProductCreate, ProductUpdate, 
-    PaginatedResponse, User
+    ProductResponse, ProductCard, ProductCreate, ProductUpdate, 
+    PaginatedResponse, User, columns_for
 )
 from auth import get_current_user, get_current_admin_user
 
 router = APIRouter(prefix="/products", tags=["products"])
 
+# Sort keys per sort_by value; id breaks ties so keyset cursors are stable.
+# rating_desc matches idx_products_active_rating, with unrated products last.
+PRODUCT_ORDERINGS = {
+    "name_asc": [("name", False), ("id", False)],
+    "name_desc": [("name", True), ("id", True)],
+    "price_asc": [("price", False), ("id", False)],
+    "price_desc": [("price", True), ("id", True)],
+    "created_desc": [("created_at", True), ("id", True)],
+    "rating_desc": [("average_rating", True), ("review_count", True), ("id", True)],
+    # Rows arrive already ranked by search_products(); offset pagination only
+    "relevance": [],
+}
+NULLABLE_SORT_COLUMNS = ("average_rating",)
+
+# Column projections per view, derived from the response models. Listings use
+# the card projection and skip descriptions, image galleries and spec blobs.
+PRODUCT_CARD_COLUMNS = columns_for(ProductCard, table="products")
+PRODUCT_DETAIL_COLUMNS = columns_for(ProductResponse, table="products")
+CATEGORY_EMBED = "category:categories(id, name, slug)"
+
 @router.get("/", response_model=PaginatedResponse)
 async def get_products(
     page: int = Query(1, ge=1),
     limit: int = Query(12, ge=1, le=100),
     category_id: Optional[str] = None,
-    search: Optional[str] = None,
-    sort_by: str = Query("created_desc"),
+    search: Optional[str] = Query(None, max_length=100),
+    sort_by: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     is_featured: Optional[bool] = None,
-    db: SupabaseDB = Depends(get_supabase_db)
+    pagination: str = Query("offset", pattern="^(offset|cursor)$"),
+    cursor: Optional[str] = None,
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
-    """Get products with filtering, search, and pagination."""
+    """Get products with filtering, search, and pagination.
+    
+    pagination=cursor seeks past the opaque `cursor` returned in meta.next_cursor
+    instead of skipping rows with an offset. With `search`, results default to
+    relevance order, which supports offset pagination only.
+    """
     
     try:
-        # Build base query
-        query = db.supabase.table("products").select("""
-            *,
-            category:categories(id, name, slug),
-            reviews(rating)
-        """).eq("is_active", True)
-        
-        # Apply filters
-        if category_id:
-            query = query.eq("category_id", category_id)
-        
         if search:
-            # Supabase text search
-            query = query.or_(f"name.ilike.%{search}%,description.ilike.%{search}%,short_description.ilike.%{search}%")
-        
-        if min_price is not None:
-            query = query.gte("price", min_price)
-        
-        if max_price is not None:
-            query = query.lte("price", max_price)
-        
-        if is_featured is not None:
-            query = query.eq("is_featured", is_featured)
-        
-        # Apply sorting
-        if sort_by == "name_asc":
-            query = query.order("name", desc=False)
-        elif sort_by == "name_desc":
-            query = query.order("name", desc=True)
-        elif sort_by == "price_asc":
-            query = query.order("price", desc=False)
-        elif sort_by == "price_desc":
-            query = query.order("price", desc=True)
-        elif sort_by == "created_desc":
-            query = query.order("created_at", desc=True)
-        elif sort_by == "rating_desc":
-            # For rating sort, we'll handle it after getting the data
-            query = query.order("created_at", desc=True)
-        
-        # Get total count for pagination
-        count_response = db.supabase.table("products").select("id", count="exact").eq("is_active", True)
-        
-        # Apply same filters for count
-        if category_id:
-            count_response = count_response.eq("category_id", category_id)
-        if search:
-            count_response = count_response.or_(f"name.ilike.%{search}%,description.ilike.%{search}%,short_description.ilike.%{search}%")
-        if min_price is not None:
-            count_response = count_response.gte("price", min_price)
-        if max_price is not None:
-            count_response = count_response.lte("price", max_price)
-        if is_featured is not None:
-            count_response = count_response.eq("is_featured", is_featured)
-            
-        count_result = count_response.execute()
-        total = count_result.count if count_result.count is not None else 0
+            # Search is case-insensitive, so equivalent spellings share a cache entry
+            search = " ".join(search.split()).lower() or None
         
-        # Apply pagination
-        offset = (page - 1) * limit
-        response = query.range(offset, offset + limit - 1).execute()
-        
-        products = response.data if response.data else []
+        if sort_by not in PRODUCT_ORDERINGS or (sort_by == "relevance" and not search):
+            sort_by = "relevance" if search else "created_desc"
         
-        # Process products to add calculated fields
-        product_data = []
-        for product in products:
-            # Calculate average rating
-            reviews = product.get("reviews", [])
-            avg_rating = None
-            review_count = len(reviews)
+        use_cursor = pagination == "cursor"
+        cache_key = catalog_cache.key(
+            "products", view="list", page=None if use_cursor else page, limit=limit,
+            category_id=category_id, search=search, sort_by=sort_by, min_price=min_price,
+            max_price=max_price, is_featured=is_featured, pagination=pagination, cursor=cursor
+        )
+        cached = catalog_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        def build_query(columns: str):
+            # One filter chain shared by the page query and the fallback count query
+            if search:
+                # Ranked full-text/trigram search; the text is passed as an RPC argument,
+                # never spliced into a filter string
+                query = db.rpc_table("search_products", {"search_query": search}).select(columns)
+            else:
+                query = db.table("products").select(columns)
+            
+            query = query.eq("is_active", True)
+            
+            if category_id:
+                query = query.eq("category_id", category_id)
+            
+            if min_price is not None:
+                query = query.gte("price", min_price)
             
-            if reviews:
-                ratings = [r["rating"] for r in reviews if r.get("rating")]
-                avg_rating = sum(ratings) / len(ratings) if ratings else None
+            if max_price is not None:
+                query = query.lte("price", max_price)
             
-            product_dict = {
-                **product,
-                "average_rating": avg_rating,
-                "review_count": review_count
-            }
-            # Remove the reviews array from the response
-            product_dict.pop("reviews", None)
-            product_data.append(product_dict)
-        
-        # Sort by rating if requested
-        if sort_by == "rating_desc":
-            product_data.sort(key=lambda x: x.get("average_rating") or 0, reverse=True)
-        
-        return PaginatedResponse(
-            success=True,
-            data=product_data,
-            pagination={
-                "page": page,
-                "limit": limit,
-                "total": total,
-                "total_pages": (total + limit - 1) // limit
-            }
+            if is_featured is not None:
+                query = query.eq("is_featured", is_featured)
+            
+            return query
+        
+        # Apply sorting and pagination; the page and its total count come back in one request.
+        # average_rating and review_count are maintained on the product row
+        product_data, meta = await db.paginate(
+            build_query(f"{PRODUCT_CARD_COLUMNS}, {CATEGORY_EMBED}"),
+            PRODUCT_ORDERINGS[sort_by],
+            limit=limit,
+            page=page,
+            use_cursor=use_cursor,
+            cursor=cursor,
+            sort=sort_by,
+            count_key=("products", category_id, search, min_price, max_price, is_featured),
+            count_query=build_query("id"),
+            nullable=NULLABLE_SORT_COLUMNS
         )
         
+        result = PaginatedResponse(data=product_data, meta=meta)
+        catalog_cache.set(cache_key, result)
+        return result
+        
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching products: {str(e)}"
         )
 
-@router.get("/featured", response_model=List[ProductResponse])
+@router.get("/featured", response_model=List[ProductCard])
 async def get_featured_products(
     limit: int = Query(8, ge=1, le=20),
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Get featured products."""
     try:
-        response = db.supabase.table("products").select("*").eq("is_active", True).eq("is_featured", True).limit(limit).execute()
+        cache_key = catalog_cache.key("products", view="featured", limit=limit)
+        cached = catalog_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        return response.data if response.data else []
+        response = await db.execute(db.table("products").select(PRODUCT_CARD_COLUMNS).eq("is_active", True).eq("is_featured", True).limit(limit))
+        
+        products = response.data if response.data else []
+        catalog_cache.set(cache_key, products)
+        return products
         
     except Exception as e:
         raise HTTPException(
@@ -151,7 +152,7 @@ async def get_featured_products(
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(
     product_id: str,
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Get a single product by ID."""
     try:
@@ -164,11 +165,12 @@ async def get_product(
                 detail="Invalid product ID format"
             )
         
-        response = db.supabase.table("products").select("""
-            *,
-            category:categories(id, name, slug),
-            reviews(id, rating, comment, user_id, created_at, user:users(first_name, last_name))
-        """).eq("id", product_id).eq("is_active", True).execute()
+        cache_key = catalog_cache.key("products", view="id", id=product_id)
+        cached = catalog_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        response = await db.execute(db.table("products").select(f"{PRODUCT_DETAIL_COLUMNS}, {CATEGORY_EMBED}").eq("id", product_id).eq("is_active", True))
         
         if not response.data:
             raise HTTPException(
@@ -176,21 +178,8 @@ async def get_product(
                 detail="Product not found"
             )
         
-        product = response.data[0]
-        
-        # Calculate average rating
-        reviews = product.get("reviews", [])
-        avg_rating = None
-        review_count = len(reviews)
-        
-        if reviews:
-            ratings = [r["rating"] for r in reviews if r.get("rating")]
-            avg_rating = sum(ratings) / len(ratings) if ratings else None
-        
-        product["average_rating"] = avg_rating
-        product["review_count"] = review_count
-        
-        return product
+        catalog_cache.set(cache_key, response.data[0])
+        return response.data[0]
         
     except HTTPException:
         raise
@@ -203,15 +192,16 @@ async def get_product(
 @router.get("/slug/{slug}", response_model=ProductResponse)
 async def get_product_by_slug(
     slug: str,
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Get a single product by slug."""
     try:
-        response = db.supabase.table("products").select("""
-            *,
-            category:categories(id, name, slug),
-            reviews(id, rating, comment, user_id, created_at, user:users(first_name, last_name))
-        """).eq("slug", slug).eq("is_active", True).execute()
+        cache_key = catalog_cache.key("products", view="slug", slug=slug)
+        cached = catalog_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        response = await db.execute(db.table("products").select(f"{PRODUCT_DETAIL_COLUMNS}, {CATEGORY_EMBED}").eq("slug", slug).eq("is_active", True))
         
         if not response.data:
             raise HTTPException(
@@ -219,21 +209,8 @@ async def get_product_by_slug(
                 detail="Product not found"
             )
         
-        product = response.data[0]
-        
-        # Calculate average rating
-        reviews = product.get("reviews", [])
-        avg_rating = None
-        review_count = len(reviews)
-        
-        if reviews:
-            ratings = [r["rating"] for r in reviews if r.get("rating")]
-            avg_rating = sum(ratings) / len(ratings) if ratings else None
-        
-        product["average_rating"] = avg_rating
-        product["review_count"] = review_count
-        
-        return product
+        catalog_cache.set(cache_key, response.data[0])
+        return response.data[0]
         
     except HTTPException:
         raise
@@ -247,12 +224,12 @@ async def get_product_by_slug(
 async def create_product(
     product_data: ProductCreate,
     current_user: User = Depends(get_current_admin_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Create a new product (admin only)."""
     try:
         # Check if slug already exists
-        existing_slug = db.supabase.table("products").select("id").eq("slug", product_data.slug).execute()
+        existing_slug = await db.execute(db.table("products").select("id").eq("slug", product_data.slug))
         if existing_slug.data:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -261,7 +238,7 @@ async def create_product(
         
         # Check if SKU already exists
         if product_data.sku:
-            existing_sku = db.supabase.table("products").select("id").eq("sku", product_data.sku).execute()
+            existing_sku = await db.execute(db.table("products").select("id").eq("sku", product_data.sku))
             if existing_sku.data:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -271,7 +248,7 @@ async def create_product(
         # Create product
         product_dict = product_data.dict()
         
-        response = db.supabase.table("products").insert(product_dict).execute()
+        response = await db.execute(db.table("products").insert(product_dict))
         
         if not response.data:
             raise HTTPException(
@@ -279,6 +256,8 @@ async def create_product(
                 detail="Failed to create product"
             )
         
+        catalog_cache.bump("products")
+        
         return response.data[0]
         
     except HTTPException:
@@ -294,7 +273,7 @@ async def update_product(
     product_id: str,
     product_data: ProductUpdate,
     current_user: User = Depends(get_current_admin_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Update a product (admin only)."""
     try:
@@ -308,7 +287,7 @@ async def update_product(
             )
         
         # Check if product exists
-        existing_product = db.supabase.table("products").select("id").eq("id", product_id).execute()
+        existing_product = await db.execute(db.table("products").select("id").eq("id", product_id))
         if not existing_product.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -318,7 +297,7 @@ async def update_product(
         # Update product
         update_data = product_data.dict(exclude_unset=True)
         
-        response = db.supabase.table("products").update(update_data).eq("id", product_id).execute()
+        response = await db.execute(db.table("products").update(update_data).eq("id", product_id))
         
         if not response.data:
             raise HTTPException(
@@ -326,6 +305,8 @@ async def update_product(
                 detail="Failed to update product"
             )
         
+        catalog_cache.bump("products")
+        
         return response.data[0]
         
     except HTTPException:
@@ -340,7 +321,7 @@ async def update_product(
 async def delete_product(
     product_id: str,
     current_user: User = Depends(get_current_admin_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Soft delete a product (admin only)."""
     try:
@@ -354,7 +335,7 @@ async def delete_product(
             )
         
         # Check if product exists
-        existing_product = db.supabase.table("products").select("id").eq("id", product_id).execute()
+        existing_product = await db.execute(db.table("products").select("id").eq("id", product_id))
         if not existing_product.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -362,7 +343,7 @@ async def delete_product(
             )
         
         # Soft delete (set is_active to False)
-        response = db.supabase.table("products").update({"is_active": False}).eq("id", product_id).execute()
+        response = await db.execute(db.table("products").update({"is_active": False}).eq("id", product_id))
         
         if not response.data:
             raise HTTPException(
@@ -370,6 +351,8 @@ async def delete_product(
                 detail="Failed to delete product"
             )
         
+        catalog_cache.bump("products")
+        
         return {"success": True, "message": "Product deleted successfully"}
         
     except HTTPException:
@@ -2,18 +2,31 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
 from uuid import UUID
 
-from database import get_supabase_db, SupabaseDB
-from schemas_supabase import ReviewResponse, ReviewCreate, PaginatedResponse, User
-from auth import get_current_user
+from database import get_async_db, AsyncSupabaseDB, InvalidCursorError, catalog_cache
+from schemas_supabase import ReviewResponse, ReviewCreate, PaginatedResponse
+from auth import get_current_user, get_current_admin_user
 
 router = APIRouter(prefix="/reviews", tags=["reviews"])
 
+# Newest first; id breaks ties so keyset cursors are stable
+REVIEW_ORDERING = [("created_at", True), ("id", True)]
+
+def product_ratings_changed():
+    """Drop cached product responses after a review write.
+
+    review_count/average_rating are kept by the track_product_rating trigger
+    on reviews; cached product responses still carry the old values.
+    """
+    catalog_cache.bump("products")
+
 @router.get("/product/{product_id}", response_model=PaginatedResponse)
 async def get_product_reviews(
     product_id: str,
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=50),
-    db: SupabaseDB = Depends(get_supabase_db)
+    pagination: str = Query("offset", pattern="^(offset|cursor)$"),
+    cursor: Optional[str] = None,
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Get reviews for a specific product."""
     try:
@@ -26,33 +39,32 @@ async def get_product_reviews(
                 detail="Invalid product ID format"
             )
         
-        # Get total count
-        count_response = db.supabase.table("reviews").select("id", count="exact").eq("product_id", product_id).eq("is_approved", True).execute()
-        total = count_response.count if count_response.count is not None else 0
-        
-        # Get reviews with pagination
-        offset = (page - 1) * limit
-        response = db.supabase.table("reviews").select("""
-            *,
-            user:users(first_name, last_name),
-            product:products(name)
-        """).eq("product_id", product_id).eq("is_approved", True).order("created_at", desc=True).range(offset, offset + limit - 1).execute()
-        
-        reviews = response.data if response.data else []
-        
-        return PaginatedResponse(
-            success=True,
-            data=reviews,
-            pagination={
-                "page": page,
-                "limit": limit,
-                "total": total,
-                "total_pages": (total + limit - 1) // limit
-            }
+        # Get reviews with pagination and total count
+        reviews, meta = await db.paginate(
+            db.table("reviews").select("""
+                *,
+                user:users(first_name, last_name),
+                product:products(name)
+            """).eq("product_id", product_id).eq("is_approved", True),
+            REVIEW_ORDERING,
+            limit=limit,
+            page=page,
+            use_cursor=pagination == "cursor",
+            cursor=cursor,
+            sort="reviews",
+            count_key=("reviews", product_id),
+            count_query=db.table("reviews").select("id").eq("product_id", product_id).eq("is_approved", True)
         )
         
+        return PaginatedResponse(data=reviews, meta=meta)
+        
     except HTTPException:
         raise
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -61,15 +73,15 @@ async def get_product_reviews(
 
 @router.get("/user", response_model=List[ReviewResponse])
 async def get_user_reviews(
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Get current user's reviews."""
     try:
-        response = db.supabase.table("reviews").select("""
+        response = await db.execute(db.table("reviews").select("""
             *,
             product:products(id, name, image_url)
-        """).eq("user_id", current_user.id).order("created_at", desc=True).execute()
+        """).eq("user_id", current_user["id"]).order("created_at", desc=True))
         
         return response.data if response.data else []
         
@@ -82,8 +94,8 @@ async def get_user_reviews(
 @router.post("/", response_model=ReviewResponse)
 async def create_review(
     review_data: ReviewCreate,
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Create a product review."""
     try:
@@ -97,7 +109,7 @@ async def create_review(
             )
         
         # Check if product exists
-        product_response = db.supabase.table("products").select("id").eq("id", review_data.product_id).execute()
+        product_response = await db.execute(db.table("products").select("id").eq("id", review_data.product_id))
         if not product_response.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -105,17 +117,17 @@ async def create_review(
             )
         
         # Check if user has purchased this product
-        order_check_response = db.supabase.table("order_items").select("""
+        order_check_response = await db.execute(db.table("order_items").select("""
             id,
             order:orders(id, status, user_id)
-        """).eq("product_id", review_data.product_id).execute()
+        """).eq("product_id", review_data.product_id))
         
         has_purchased = False
         order_id = None
         
         if order_check_response.data:
             for item in order_check_response.data:
-                if (item["order"]["user_id"] == current_user.id and 
+                if (item["order"]["user_id"] == current_user["id"] and 
                     item["order"]["status"] == "delivered"):
                     has_purchased = True
                     order_id = item["order"]["id"]
@@ -128,7 +140,7 @@ async def create_review(
             )
         
         # Check if user already reviewed this product
-        existing_review_response = db.supabase.table("reviews").select("id").eq("user_id", current_user.id).eq("product_id", review_data.product_id).execute()
+        existing_review_response = await db.execute(db.table("reviews").select("id").eq("user_id", current_user["id"]).eq("product_id", review_data.product_id))
         
         if existing_review_response.data:
             raise HTTPException(
@@ -139,13 +151,13 @@ async def create_review(
         # Create review
         review_dict = review_data.dict()
         review_dict.update({
-            "user_id": current_user.id,
+            "user_id": current_user["id"],
             "order_id": order_id,
             "is_verified": True,  # Since we verified the purchase
             "is_approved": True   # Auto-approve verified reviews
         })
         
-        response = db.supabase.table("reviews").insert(review_dict).execute()
+        response = await db.execute(db.table("reviews").insert(review_dict))
         
         if not response.data:
             raise HTTPException(
@@ -153,12 +165,15 @@ async def create_review(
                 detail="Failed to create review"
             )
         
+        # Verified reviews are auto-approved, so they count immediately
+        product_ratings_changed()
+        
         # Get created review with related data
-        created_review_response = db.supabase.table("reviews").select("""
+        created_review_response = await db.execute(db.table("reviews").select("""
             *,
             user:users(first_name, last_name),
             product:products(name)
-        """).eq("id", response.data[0]["id"]).execute()
+        """).eq("id", response.data[0]["id"]))
         
         return created_review_response.data[0]
         
@@ -174,8 +189,8 @@ async def create_review(
 async def update_review(
     review_id: str,
     review_data: ReviewCreate,
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Update a review (only by the review author)."""
     try:
@@ -189,7 +204,7 @@ async def update_review(
             )
         
         # Check if review exists and belongs to current user
-        review_response = db.supabase.table("reviews").select("*").eq("id", review_id).eq("user_id", current_user.id).execute()
+        review_response = await db.execute(db.table("reviews").select("*").eq("id", review_id).eq("user_id", current_user["id"]))
         
         if not review_response.data:
             raise HTTPException(
@@ -197,11 +212,13 @@ async def update_review(
                 detail="Review not found"
             )
         
+        existing_review = review_response.data[0]
+        
         # Update review (may require re-approval)
         update_data = review_data.dict()
         update_data["is_approved"] = False  # Require re-approval after edit
         
-        response = db.supabase.table("reviews").update(update_data).eq("id", review_id).execute()
+        response = await db.execute(db.table("reviews").update(update_data).eq("id", review_id))
         
         if not response.data:
             raise HTTPException(
@@ -209,6 +226,10 @@ async def update_review(
                 detail="Failed to update review"
             )
         
+        # The old rating stops counting until the edit is re-approved
+        if existing_review.get("is_approved"):
+            product_ratings_changed()
+        
         return response.data[0]
         
     except HTTPException:
@@ -222,8 +243,8 @@ async def update_review(
 @router.delete("/{review_id}")
 async def delete_review(
     review_id: str,
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Delete a review (only by the review author)."""
     try:
@@ -237,7 +258,7 @@ async def delete_review(
             )
         
         # Check if review exists and belongs to current user
-        review_response = db.supabase.table("reviews").select("id").eq("id", review_id).eq("user_id", current_user.id).execute()
+        review_response = await db.execute(db.table("reviews").select("id, is_approved").eq("id", review_id).eq("user_id", current_user["id"]))
         
         if not review_response.data:
             raise HTTPException(
@@ -245,8 +266,10 @@ async def delete_review(
                 detail="Review not found"
             )
         
+        existing_review = review_response.data[0]
+        
         # Delete review
-        delete_response = db.supabase.table("reviews").delete().eq("id", review_id).execute()
+        delete_response = await db.execute(db.table("reviews").delete().eq("id", review_id))
         
         if not delete_response.data:
             raise HTTPException(
@@ -254,6 +277,9 @@ async def delete_review(
                 detail="Failed to delete review"
             )
         
+        if existing_review.get("is_approved"):
+            product_ratings_changed()
+        
         return {"success": True, "message": "Review deleted successfully"}
         
     except HTTPException:
@@ -267,23 +293,16 @@ async def delete_review(
 # Admin endpoints
 @router.get("/admin/pending", response_model=List[ReviewResponse])
 async def get_pending_reviews(
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Get pending reviews for admin approval."""
     try:
-        # Check if user is admin (you may want to implement proper admin check)
-        if not current_user.is_admin:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Admin access required"
-            )
-        
-        response = db.supabase.table("reviews").select("""
+        response = await db.execute(db.table("reviews").select("""
             *,
             user:users(first_name, last_name, email),
             product:products(name)
-        """).eq("is_approved", False).order("created_at", desc=False).execute()
+        """).eq("is_approved", False).order("created_at", desc=False))
         
         return response.data if response.data else []
         
@@ -298,18 +317,11 @@ async def get_pending_reviews(
 @router.put("/admin/{review_id}/approve")
 async def approve_review(
     review_id: str,
-    current_user: User = Depends(get_current_user),
-    db: SupabaseDB = Depends(get_supabase_db)
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncSupabaseDB = Depends(get_async_db)
 ):
     """Approve a review (admin only)."""
     try:
-        # Check if user is admin
-        if not current_user.is_admin:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Admin access required"
-            )
-        
         # Validate UUID format
         try:
             UUID(review_id)
@@ -319,17 +331,26 @@ async def approve_review(
                 detail="Invalid review ID format"
             )
         
-        # Update review approval status
-        response = db.supabase.table("reviews").update({
-            "is_approved": True
-        }).eq("id", review_id).execute()
+        review_response = await db.execute(db.table("reviews").select("id, is_approved").eq("id", review_id))
         
-        if not response.data:
+        if not review_response.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Review not found"
             )
         
+        review = review_response.data[0]
+        if review.get("is_approved"):
+            return {"success": True, "message": "Review approved"}
+        
+        # Update review approval status
+        response = await db.execute(db.table("reviews").update({
+            "is_approved": True
+        }).eq("id", review_id).eq("is_approved", False))
+        
+        if response.data:
+            product_ratings_changed()
+        
         return {"success": True, "message": "Review approved"}
         
     except HTTPException:
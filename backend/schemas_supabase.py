@@ -17,6 +17,52 @@ class BaseModelConfig(BaseModel):
         }
     )
 
+# Columns of the tables read with explicit projections, as created by
+# supabase_schema.sql (CREATE TABLE plus its ALTER TABLE additions). PostgREST
+# rejects a select naming a column the table lacks, so model fields the
+# schema does not have are left to their defaults.
+TABLE_COLUMNS = {
+    "users": (
+        "id", "email", "password_hash", "first_name", "last_name", "phone",
+        "is_admin", "is_active", "created_at", "updated_at"
+    ),
+    "products": (
+        "id", "name", "description", "short_description", "price", "compare_price", "sku",
+        "stock_quantity", "category_id", "image_url", "images", "specifications", "is_active",
+        "is_featured", "weight", "dimensions", "battery_life", "max_range", "max_speed",
+        "camera_resolution", "has_gps", "has_obstacle_avoidance", "warranty_months", "slug",
+        "meta_title", "meta_description", "created_at", "updated_at",
+        "review_count", "rating_sum", "average_rating"
+    ),
+    "orders": (
+        "id", "user_id", "order_number", "status", "payment_status", "payment_method", "payment_id",
+        "subtotal", "tax_amount", "shipping_cost", "discount_amount", "total_amount", "currency",
+        "shipping_address", "billing_address", "tracking_number", "shipped_at", "delivered_at",
+        "notes", "created_at", "updated_at"
+    ),
+    "order_items": (
+        "id", "order_id", "product_id", "quantity", "unit_price", "total_price",
+        "customizations", "created_at"
+    ),
+}
+
+def table_columns(table: str, exclude: tuple = ()) -> str:
+    """PostgREST select list of every column of a table (see TABLE_COLUMNS)."""
+    return ", ".join(name for name in TABLE_COLUMNS[table] if name not in exclude)
+
+def columns_for(*models: type, table: str, exclude: tuple = ()) -> str:
+    """PostgREST select list covering the fields of the given models that the table has.
+
+    Read paths select exactly what their response model serializes instead of
+    "*", so unused wide columns never leave the database.
+    """
+    available = TABLE_COLUMNS[table]
+    columns = dict.fromkeys(
+        name for model in models for name in model.model_fields
+        if name in available and name not in exclude
+    )
+    return ", ".join(columns)
+
 # User Models
 class UserBase(BaseModelConfig):
     email: EmailStr
@@ -140,6 +186,24 @@ class Product(ProductBase):
 class ProductResponse(ProductBase):
     id: UUID
     created_at: datetime
+    average_rating: Optional[float] = None
+    review_count: int = 0
+
+class ProductCard(BaseModelConfig):
+    """Listing view of a product: what a product card renders, nothing more."""
+    id: UUID
+    name: str
+    slug: str
+    short_description: Optional[str] = None
+    price: Decimal
+    compare_price: Optional[Decimal] = None
+    stock_quantity: int = 0
+    category_id: Optional[UUID] = None
+    image_url: Optional[str] = None
+    is_featured: bool = False
+    average_rating: Optional[float] = None
+    review_count: int = 0
+    created_at: datetime
 
 # Cart Item Models
 class CartItemBase(BaseModelConfig):
@@ -166,6 +230,10 @@ class CartItemResponse(CartItemBase):
     id: UUID
     created_at: datetime
 
+class GuestCartItem(BaseModelConfig):
+    product_id: UUID
+    quantity: int = Field(default=1, gt=0)
+
 # Order Models
 class OrderBase(BaseModelConfig):
     user_id: Optional[UUID] = None
@@ -306,10 +374,11 @@ class ResponseModel(BaseModelConfig):
     data: Optional[Any] = None
 
 class PaginationMeta(BaseModelConfig):
-    page: int
+    page: Optional[int] = None  # Not set in cursor mode
     per_page: int
     total: int
     pages: int
+    next_cursor: Optional[str] = None
 
 class PaginatedResponse(BaseModelConfig):
     data: List[Any]
@@ -438,3 +438,543 @@ CREATE TRIGGER update_service_bookings_updated_at BEFORE UPDATE ON service_booki
 
 CREATE TRIGGER update_product_comparisons_updated_at BEFORE UPDATE ON product_comparisons
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Product rating aggregates
+-- Maintained incrementally by a trigger on reviews so listings never scan
+-- reviews. Only approved reviews are counted.
+ALTER TABLE products ADD COLUMN IF NOT EXISTS review_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS rating_sum INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS average_rating DECIMAL(3, 2);
+
+CREATE OR REPLACE FUNCTION adjust_product_rating(
+    p_product_id UUID,
+    p_count_delta INTEGER,
+    p_rating_delta INTEGER
+)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE products
+    SET review_count = GREATEST(review_count + p_count_delta, 0),
+        rating_sum = GREATEST(rating_sum + p_rating_delta, 0),
+        average_rating = CASE
+            WHEN review_count + p_count_delta > 0
+            THEN ROUND((rating_sum + p_rating_delta)::numeric / (review_count + p_count_delta), 2)
+            ELSE NULL
+        END
+    WHERE id = p_product_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Each insert, edit, approval or delete of a review is applied once, under the
+-- review's row lock, so concurrent writes cannot double-count. Runs as owner,
+-- since adjust_product_rating is server-only (see below).
+CREATE OR REPLACE FUNCTION track_product_rating()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.is_approved IS NOT DISTINCT FROM NEW.is_approved
+       AND OLD.rating = NEW.rating
+       AND OLD.product_id = NEW.product_id THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_approved THEN
+        PERFORM adjust_product_rating(OLD.product_id, -1, -OLD.rating);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_approved THEN
+        PERFORM adjust_product_rating(NEW.product_id, 1, NEW.rating);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS track_reviews_product_rating ON reviews;
+CREATE TRIGGER track_reviews_product_rating
+    AFTER INSERT OR UPDATE OR DELETE ON reviews
+    FOR EACH ROW EXECUTE FUNCTION track_product_rating();
+
+-- Backfill aggregates from existing approved reviews
+UPDATE products p
+SET review_count = COALESCE(r.review_count, 0),
+    rating_sum = COALESCE(r.rating_sum, 0),
+    average_rating = r.average_rating
+FROM (
+    SELECT product_id,
+           COUNT(*) AS review_count,
+           SUM(rating) AS rating_sum,
+           ROUND(AVG(rating)::numeric, 2) AS average_rating
+    FROM reviews
+    WHERE is_approved = true
+    GROUP BY product_id
+) r
+WHERE r.product_id = p.id;
+
+-- Global rating sort for product listings (sort_by=rating_desc)
+CREATE INDEX IF NOT EXISTS idx_products_active_rating
+    ON products(is_active, average_rating DESC NULLS LAST, review_count DESC, id DESC);
+
+-- Keyset (cursor) pagination: composite indexes matching each listing's ORDER BY
+CREATE INDEX IF NOT EXISTS idx_products_active_created ON products(is_active, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_active_price ON products(is_active, price, id);
+CREATE INDEX IF NOT EXISTS idx_products_active_name ON products(is_active, name, id);
+CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_reviews_product_approved_created
+    ON reviews(product_id, is_approved, created_at DESC, id DESC);
+
+-- Product search
+-- Weighted full-text document (name > short description > description) plus a
+-- trigram index on name for typo-tolerant matches. search_products() ranks by both.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION product_search_document(
+    p_name TEXT,
+    p_short_description TEXT,
+    p_description TEXT
+)
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('english', coalesce(p_name, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(p_short_description, '')), 'B')
+        || setweight(to_tsvector('english', coalesce(p_description, '')), 'C')
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Turns free text into a prefix query: "dji min" -> 'dji':* & 'min':*
+CREATE OR REPLACE FUNCTION product_search_query(p_search TEXT)
+RETURNS tsquery AS $$
+    SELECT to_tsquery('english', string_agg(word || ':*', ' & '))
+    FROM regexp_split_to_table(lower(coalesce(p_search, '')), '[^[:alnum:]]+') AS word
+    WHERE word <> ''
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE INDEX IF NOT EXISTS idx_products_search_document ON products
+    USING GIN (product_search_document(name::text, short_description::text, description));
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING GIN (name gin_trgm_ops);
+
+CREATE OR REPLACE FUNCTION search_products(search_query TEXT)
+RETURNS SETOF products AS $$
+    SELECT p.*
+    FROM products p, product_search_query(search_query) q
+    WHERE product_search_document(p.name::text, p.short_description::text, p.description) @@ q
+       OR p.name % search_query
+    ORDER BY ts_rank(product_search_document(p.name::text, p.short_description::text, p.description), q)
+             + similarity(p.name, search_query) DESC,
+             p.id DESC
+$$ LANGUAGE sql STABLE;
+
+-- Inventory holds
+-- Short-lived reservations taken when checkout starts, one row per (user, product).
+-- A product's available stock is stock_quantity minus its unexpired holds;
+-- expired rows are ignored at once and deleted by the API's sweeper.
+CREATE TABLE IF NOT EXISTS inventory_holds (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    product_id UUID NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL CHECK (quantity > 0),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (user_id, product_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_inventory_holds_product_expiry ON inventory_holds(product_id, expires_at);
+CREATE INDEX IF NOT EXISTS idx_inventory_holds_expiry ON inventory_holds(expires_at);
+
+-- Unexpired units held on a product, optionally ignoring one user's own holds
+CREATE OR REPLACE FUNCTION held_quantity(p_product_id UUID, p_exclude_user_id UUID DEFAULT NULL)
+RETURNS INTEGER AS $$
+    SELECT COALESCE(SUM(quantity), 0)::INTEGER
+    FROM inventory_holds
+    WHERE product_id = p_product_id
+      AND expires_at > NOW()
+      AND user_id IS DISTINCT FROM p_exclude_user_id
+$$ LANGUAGE sql STABLE;
+
+-- Takes (or refreshes) holds on everything in a user's cart for p_ttl_seconds.
+-- Product rows are locked in id order, like checkout, so holds and orders on
+-- the same product are serialized and cannot overcommit stock.
+CREATE OR REPLACE FUNCTION reserve_cart(p_user_id UUID, p_ttl_seconds INTEGER)
+RETURNS JSONB AS $$
+DECLARE
+    v_expires_at TIMESTAMP WITH TIME ZONE := NOW() + make_interval(secs => p_ttl_seconds);
+    v_short_product TEXT;
+BEGIN
+    PERFORM 1
+    FROM products
+    WHERE id IN (SELECT product_id FROM cart_items WHERE user_id = p_user_id)
+    ORDER BY id
+    FOR UPDATE;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM cart_items c JOIN products p ON p.id = c.product_id
+        WHERE c.user_id = p_user_id
+    ) THEN
+        RAISE EXCEPTION 'Cart is empty';
+    END IF;
+
+    SELECT p.name INTO v_short_product
+    FROM (
+        SELECT product_id, SUM(quantity) AS quantity
+        FROM cart_items WHERE user_id = p_user_id GROUP BY product_id
+    ) c
+    JOIN products p ON p.id = c.product_id
+    WHERE COALESCE(p.stock_quantity, 0) - held_quantity(p.id, p_user_id) < c.quantity
+    LIMIT 1;
+
+    IF v_short_product IS NOT NULL THEN
+        RAISE EXCEPTION 'Insufficient stock for product: %', v_short_product;
+    END IF;
+
+    -- Replace the user's previous holds with the current cart
+    DELETE FROM inventory_holds WHERE user_id = p_user_id;
+
+    INSERT INTO inventory_holds (user_id, product_id, quantity, expires_at)
+    SELECT c.user_id, c.product_id, SUM(c.quantity), v_expires_at
+    FROM cart_items c JOIN products p ON p.id = c.product_id
+    WHERE c.user_id = p_user_id
+    GROUP BY c.user_id, c.product_id;
+
+    RETURN jsonb_build_object(
+        'expires_at', v_expires_at,
+        'items', (
+            SELECT jsonb_agg(jsonb_build_object('product_id', product_id, 'quantity', quantity))
+            FROM inventory_holds WHERE user_id = p_user_id
+        )
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION release_cart_holds(p_user_id UUID)
+RETURNS INTEGER AS $$
+    WITH released AS (
+        DELETE FROM inventory_holds WHERE user_id = p_user_id RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM released
+$$ LANGUAGE sql;
+
+-- Called periodically by the API; expired holds already stop counting before this runs
+CREATE OR REPLACE FUNCTION release_expired_holds()
+RETURNS INTEGER AS $$
+    WITH released AS (
+        DELETE FROM inventory_holds WHERE expires_at <= NOW() RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM released
+$$ LANGUAGE sql;
+
+-- Checkout
+-- Turns a user's cart into an order in one transaction: locks the cart's product
+-- rows (in id order, so concurrent checkouts cannot deadlock), validates stock,
+-- writes the order and all its items, decrements stock and clears the cart.
+-- Any failure rolls the whole checkout back. Rows are built with
+-- jsonb_populate_record so keys for columns a deployment lacks are ignored.
+CREATE OR REPLACE FUNCTION create_order_from_cart(
+    p_user_id UUID,
+    p_order_number TEXT,
+    p_details JSONB DEFAULT '{}'::jsonb
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_order_id UUID := uuid_generate_v4();
+    v_subtotal DECIMAL(10, 2);
+    v_shipping DECIMAL(10, 2);
+    v_tax DECIMAL(10, 2);
+    v_total DECIMAL(10, 2);
+    v_short_product TEXT;
+BEGIN
+    PERFORM 1
+    FROM products
+    WHERE id IN (SELECT product_id FROM cart_items WHERE user_id = p_user_id)
+    ORDER BY id
+    FOR UPDATE;
+
+    -- Re-read the cart after taking the locks: a concurrent checkout by the same
+    -- user may have consumed it while we waited
+    IF NOT EXISTS (
+        SELECT 1 FROM cart_items c JOIN products p ON p.id = c.product_id
+        WHERE c.user_id = p_user_id
+    ) THEN
+        RAISE EXCEPTION 'Cart is empty';
+    END IF;
+
+    SELECT p.name INTO v_short_product
+    FROM (
+        SELECT product_id, SUM(quantity) AS quantity
+        FROM cart_items WHERE user_id = p_user_id GROUP BY product_id
+    ) c
+    JOIN products p ON p.id = c.product_id
+    WHERE COALESCE(p.stock_quantity, 0) - held_quantity(p.id, p_user_id) < c.quantity
+    LIMIT 1;
+
+    IF v_short_product IS NOT NULL THEN
+        RAISE EXCEPTION 'Insufficient stock for product: %', v_short_product;
+    END IF;
+
+    SELECT SUM(p.price * c.quantity) INTO v_subtotal
+    FROM cart_items c JOIN products p ON p.id = c.product_id
+    WHERE c.user_id = p_user_id;
+
+    -- Free shipping over 8,300; 8% tax
+    v_shipping := CASE WHEN v_subtotal < 8300 THEN 830 ELSE 0 END;
+    v_tax := ROUND(v_subtotal * 0.08, 2);
+    v_total := v_subtotal + v_shipping + v_tax;
+
+    -- Server-computed fields override anything in p_details
+    INSERT INTO orders
+    SELECT * FROM jsonb_populate_record(NULL::orders, p_details || jsonb_build_object(
+        'id', v_order_id,
+        'user_id', p_user_id,
+        'order_number', p_order_number,
+        'status', 'pending',
+        'payment_status', 'pending',
+        'subtotal', v_subtotal,
+        'tax_amount', v_tax,
+        'shipping_amount', v_shipping,
+        'shipping_cost', v_shipping,
+        'discount_amount', 0,
+        'total_amount', v_total,
+        'currency', 'INR',
+        'created_at', NOW(),
+        'updated_at', NOW()
+    ));
+
+    INSERT INTO order_items
+    SELECT * FROM jsonb_populate_recordset(NULL::order_items, (
+        SELECT jsonb_agg(jsonb_build_object(
+            'id', uuid_generate_v4(),
+            'order_id', v_order_id,
+            'product_id', p.id,
+            'product_name', p.name,
+            'product_sku', p.sku,
+            'quantity', c.quantity,
+            'unit_price', p.price,
+            'total_price', p.price * c.quantity,
+            'customizations', '{}'::jsonb,
+            'created_at', NOW()
+        ))
+        FROM cart_items c JOIN products p ON p.id = c.product_id
+        WHERE c.user_id = p_user_id
+    ));
+
+    UPDATE products p
+    SET stock_quantity = p.stock_quantity - c.quantity
+    FROM (
+        SELECT product_id, SUM(quantity) AS quantity
+        FROM cart_items WHERE user_id = p_user_id GROUP BY product_id
+    ) c
+    WHERE p.id = c.product_id;
+
+    DELETE FROM cart_items WHERE user_id = p_user_id;
+    -- The order consumes the buyer's holds
+    DELETE FROM inventory_holds WHERE user_id = p_user_id;
+
+    RETURN jsonb_build_object(
+        'order_id', v_order_id,
+        'order_number', p_order_number,
+        'total_amount', v_total
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Order cancellation
+-- Flips a cancellable order to 'cancelled' and returns its items to stock in
+-- one transaction. The status guard makes a repeated or concurrent cancel a
+-- no-op, so stock is never restored twice. Stock is adjusted relatively
+-- (stock_quantity + n), so it cannot clobber concurrent checkouts.
+CREATE OR REPLACE FUNCTION cancel_order_and_restock(p_order_id UUID)
+RETURNS INTEGER AS $$
+DECLARE
+    v_restocked INTEGER;
+BEGIN
+    UPDATE orders
+    SET status = 'cancelled'
+    WHERE id = p_order_id AND status IN ('pending', 'confirmed');
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Order cannot be cancelled';
+    END IF;
+
+    UPDATE products p
+    SET stock_quantity = p.stock_quantity + i.quantity
+    FROM (
+        SELECT product_id, SUM(quantity) AS quantity
+        FROM order_items
+        WHERE order_id = p_order_id AND product_id IS NOT NULL
+        GROUP BY product_id
+    ) i
+    WHERE p.id = i.product_id;
+
+    GET DIAGNOSTICS v_restocked = ROW_COUNT;
+    RETURN v_restocked;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cart writes
+-- Add-or-increment in one statement on the (user_id, product_id) key. Stock is
+-- checked against what other buyers' checkout holds leave available; raising
+-- rolls the upsert back. Returns the cart row with its product embedded.
+CREATE OR REPLACE FUNCTION add_to_cart(p_user_id UUID, p_product_id UUID, p_quantity INTEGER)
+RETURNS JSONB AS $$
+DECLARE
+    v_product products%ROWTYPE;
+    v_item cart_items%ROWTYPE;
+BEGIN
+    SELECT * INTO v_product FROM products WHERE id = p_product_id AND is_active = true;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Product not found' USING ERRCODE = 'no_data_found';
+    END IF;
+
+    INSERT INTO cart_items (user_id, product_id, quantity)
+    VALUES (p_user_id, p_product_id, p_quantity)
+    ON CONFLICT (user_id, product_id)
+    DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity, updated_at = NOW()
+    RETURNING * INTO v_item;
+
+    IF v_item.quantity > COALESCE(v_product.stock_quantity, 0) - held_quantity(p_product_id, p_user_id) THEN
+        RAISE EXCEPTION 'Insufficient stock';
+    END IF;
+
+    RETURN to_jsonb(v_item) || jsonb_build_object('product', jsonb_build_object(
+        'id', v_product.id,
+        'name', v_product.name,
+        'price', v_product.price,
+        'image_url', v_product.image_url,
+        'stock_quantity', v_product.stock_quantity,
+        'is_active', v_product.is_active
+    ));
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cart badge: item count and subtotal in one aggregate, no rows transferred
+CREATE OR REPLACE FUNCTION cart_summary(p_user_id UUID)
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object(
+        'count', COALESCE(SUM(c.quantity), 0),
+        'subtotal', COALESCE(SUM(c.quantity * p.price), 0)
+    )
+    FROM cart_items c JOIN products p ON p.id = c.product_id
+    WHERE c.user_id = p_user_id
+$$ LANGUAGE sql STABLE;
+
+-- Guest cart merge on login
+-- p_items: [{"product_id": ..., "quantity": ...}] from the signed guest cart.
+-- Quantities are clamped to available stock and merged with GREATEST, so
+-- replaying the same guest cart is a no-op. Returns the number of rows written.
+CREATE OR REPLACE FUNCTION merge_guest_cart(p_user_id UUID, p_items JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_merged INTEGER;
+BEGIN
+    INSERT INTO cart_items (user_id, product_id, quantity)
+    SELECT p_user_id, p.id, LEAST(g.quantity, COALESCE(p.stock_quantity, 0) - held_quantity(p.id, p_user_id))
+    FROM (
+        SELECT product_id, SUM(quantity)::INTEGER AS quantity
+        FROM jsonb_to_recordset(p_items) AS item(product_id UUID, quantity INTEGER)
+        GROUP BY product_id
+    ) g
+    JOIN products p ON p.id = g.product_id AND p.is_active = true
+    WHERE COALESCE(p.stock_quantity, 0) - held_quantity(p.id, p_user_id) > 0
+    ON CONFLICT (user_id, product_id)
+    DO UPDATE SET quantity = GREATEST(cart_items.quantity, EXCLUDED.quantity), updated_at = NOW();
+
+    GET DIAGNOSTICS v_merged = ROW_COUNT;
+    RETURN v_merged;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Server-only functions
+-- These take the acting user, order or product as a plain argument, so they
+-- are callable by the API's service role only; anon and authenticated clients
+-- could otherwise act for any user through PostgREST.
+REVOKE EXECUTE ON FUNCTION adjust_product_rating(UUID, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION held_quantity(UUID, UUID) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION reserve_cart(UUID, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION release_cart_holds(UUID) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION release_expired_holds() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION create_order_from_cart(UUID, TEXT, JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION cancel_order_and_restock(UUID) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION add_to_cart(UUID, UUID, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION cart_summary(UUID) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION merge_guest_cart(UUID, JSONB) FROM PUBLIC, anon, authenticated;
+
+GRANT EXECUTE ON FUNCTION adjust_product_rating(UUID, INTEGER, INTEGER) TO service_role;
+GRANT EXECUTE ON FUNCTION held_quantity(UUID, UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION reserve_cart(UUID, INTEGER) TO service_role;
+GRANT EXECUTE ON FUNCTION release_cart_holds(UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION release_expired_holds() TO service_role;
+GRANT EXECUTE ON FUNCTION create_order_from_cart(UUID, TEXT, JSONB) TO service_role;
+GRANT EXECUTE ON FUNCTION cancel_order_and_restock(UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION add_to_cart(UUID, UUID, INTEGER) TO service_role;
+GRANT EXECUTE ON FUNCTION cart_summary(UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION merge_guest_cart(UUID, JSONB) TO service_role;
+
+-- Registration
+-- Supabase Auth owns credentials; the profile row is written by this trigger in
+-- the same transaction as the auth user, so sign-up is one call and can no longer
+-- leave an auth user without a profile. The unique email/id constraints decide
+-- duplicates: for email sign-ups a violation aborts the whole sign-up. OAuth
+-- sign-ups keep their old behaviour of logging and continuing.
+-- is_admin is never read from metadata, which users can edit.
+-- Supersedes the OAuth-only handle_new_user() in scripts/fix-oauth-password-column.sql.
+ALTER TABLE users ALTER COLUMN password_hash DROP NOT NULL;
+
+CREATE OR REPLACE FUNCTION public.handle_new_user()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_is_oauth BOOLEAN := NEW.raw_app_meta_data->>'provider' IN ('google', 'github', 'facebook', 'twitter', 'apple');
+    v_full_name TEXT;
+    v_first_name TEXT;
+    v_last_name TEXT;
+BEGIN
+    IF v_is_oauth THEN
+        v_full_name := COALESCE(
+            NEW.raw_user_meta_data->>'full_name',
+            NEW.raw_user_meta_data->>'name',
+            SPLIT_PART(NEW.email, '@', 1)
+        );
+        v_first_name := SPLIT_PART(v_full_name, ' ', 1);
+        v_last_name := SUBSTRING(v_full_name FROM POSITION(' ' IN v_full_name) + 1);
+        IF v_last_name IS NULL OR v_last_name = v_first_name THEN
+            v_last_name := '';
+        END IF;
+    ELSE
+        v_first_name := COALESCE(NULLIF(NEW.raw_user_meta_data->>'first_name', ''), SPLIT_PART(NEW.email, '@', 1));
+        v_last_name := COALESCE(NEW.raw_user_meta_data->>'last_name', '');
+    END IF;
+
+    BEGIN
+        INSERT INTO public.users (id, email, first_name, last_name, phone, is_admin, is_active, password_hash)
+        VALUES (
+            NEW.id,
+            NEW.email,
+            v_first_name,
+            v_last_name,
+            NEW.raw_user_meta_data->>'phone',
+            false,
+            true,
+            NULL
+        )
+        ON CONFLICT (id) DO UPDATE SET is_active = true, updated_at = NOW();
+    EXCEPTION
+        WHEN OTHERS THEN
+            IF NOT v_is_oauth THEN
+                RAISE;
+            END IF;
+            RAISE WARNING 'Error in handle_new_user trigger: %', SQLERRM;
+    END;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS on_auth_user_created ON auth.users;
+CREATE TRIGGER on_auth_user_created
+    AFTER INSERT ON auth.users
+    FOR EACH ROW EXECUTE FUNCTION public.handle_new_user();
+
+-- Backfill profiles for auth users whose old two-step sign-up failed halfway
+INSERT INTO users (id, email, first_name, last_name, phone)
+SELECT
+    au.id,
+    au.email,
+    COALESCE(NULLIF(au.raw_user_meta_data->>'first_name', ''), SPLIT_PART(au.email, '@', 1)),
+    COALESCE(au.raw_user_meta_data->>'last_name', ''),
+    au.raw_user_meta_data->>'phone'
+FROM auth.users au
+WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = au.id)
+ON CONFLICT DO NOTHING;
@@ -1,6 +1,12 @@
+import base64
+import json
 import random
 import string
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from typing import Any, Dict, Hashable, Optional
 
 def generate_order_number() -> str:
     """Generate a unique order number."""
@@ -34,3 +40,112 @@ def calculate_order_totals(subtotal: float, coupon_value: float = 0, coupon_type
         "tax_amount": round(tax_amount, 2),
         "total_amount": round(total_amount, 2)
     }
+
+def encode_cursor(sort: str, values: list) -> str:
+    """Encode a keyset position as an opaque, URL-safe cursor."""
+    payload = json.dumps({"s": sort, "v": values}, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> Optional[list]:
+    """Decode a cursor produced by encode_cursor for the same sort, or return None."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(payload, dict) or payload.get("s") != sort or not isinstance(payload.get("v"), list):
+        return None
+    return payload["v"]
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time-to-live."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a live entry and mark it as recently used."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store an entry, evicting the least recently used one when full."""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry and return its value."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Hit/miss counters for monitoring."""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class VersionedCache:
+    """TTL/LRU cache whose keys carry a per-namespace version.
+
+    bump() makes everything cached under a namespace unreachable at once; the
+    orphaned entries then age out through the LRU/TTL of the underlying cache.
+    Build the key before loading so a load that races a bump is stored under
+    the old version and never served.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def key(self, namespace: str, **params: Any) -> tuple:
+        """Cache key for a namespace and its query parameters; None values are dropped."""
+        normalized = tuple(sorted((name, value) for name, value in params.items() if value is not None))
+        return (namespace, self._versions.get(namespace, 0), normalized)
+
+    def get(self, key: tuple, default: Any = None) -> Any:
+        return self._cache.get(key, default)
+
+    def set(self, key: tuple, value: Any) -> None:
+        self._cache.set(key, value)
+
+    def bump(self, *namespaces: str) -> None:
+        """Invalidate every entry cached under the given namespaces."""
+        with self._lock:
+            for namespace in namespaces:
+                self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def stats(self) -> dict:
+        """Hit/miss counters plus the current namespace versions."""
+        return {**self._cache.stats(), "versions": dict(self._versions)}
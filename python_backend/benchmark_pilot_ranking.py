@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: ranking the candidates of one pilot search.
+
+Times only the ranking stage (distance, category relevance, top 3) over
+candidate sets of 100 to 100k pilots, two ways:
+
+    loop    - per-pilot math.* haversine and keyword substring checks, then a
+              full sort of the candidates (the previous implementation)
+    numpy   - PilotIndex.distances/relevance over array columns, then top_k()
+              (argpartition, sorting only the winners)
+
+Both must pick equally ranked pilots. Needs no database or API keys.
+
+    python benchmark_pilot_ranking.py --sizes 100 1000 10000 100000 --repeat 50
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+import numpy as np
+
+from benchmark_pilot_search import make_roster
+from pilot_search import PilotIndex, PilotRecord, category_keywords, haversine_km, top_k
+
+def loop_rank(candidates: list, lat: float, lng: float, category, limit: int = 3) -> list:
+    keywords = category_keywords(category)
+    ranked = []
+    for pilot in candidates:
+        dist = haversine_km(lat, lng, pilot["latitude"], pilot["longitude"])
+        specs = (pilot.get("specializations") or "").lower()
+        relevance = sum(1 for kw in keywords if kw in specs)
+        ranked.append((-relevance, round(dist, 1)))
+    ranked.sort()
+    return ranked[:limit]
+
+def numpy_rank(index: PilotIndex, rows: np.ndarray, lat: float, lng: float, category, limit: int = 3) -> list:
+    dist = index.distances(lat, lng, rows)
+    relevance = index.relevance(category_keywords(category))[rows]
+    return [(-int(relevance[position]), round(float(dist[position]), 1))
+            for position in top_k(relevance, dist, limit)]
+
+def timed(fn, repeat: int) -> tuple:
+    samples = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started_at)
+    return statistics.median(samples) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs per size (median reported)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    lat, lng, category = 17.4855, 78.3885, "agri spraying"
+    print(f"{'candidates':>10} {'loop ms':>9} {'numpy ms':>9} {'speedup':>8}")
+
+    for size in args.sizes:
+        candidates = make_roster(size, rng)
+        index = PilotIndex([PilotRecord(pilot) for pilot in candidates])
+        rows = np.arange(len(index.pilots))
+
+        loop_ms, loop_result = timed(lambda: loop_rank(candidates, lat, lng, category), args.repeat)
+        numpy_ms, numpy_result = timed(lambda: numpy_rank(index, rows, lat, lng, category), args.repeat)
+        assert loop_result == numpy_result, f"rankings differ at {size} candidates"
+
+        print(f"{size:>10} {loop_ms:>9.3f} {numpy_ms:>9.3f} {loop_ms / numpy_ms:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
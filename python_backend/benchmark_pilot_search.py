@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark: pilot radius search, full scan vs. grid index.
+
+Generates synthetic rosters of 100 to 100k pilots scattered around the known
+service areas and times a mix of searches (10/20/50 km, with and without a
+category) two ways:
+
+    scan   - the previous search: resolve, measure and rank every pilot per call
+    index  - search_pilots_page() over a PilotIndex built once per roster,
+             the path /api/pilots/search and the chat serve
+
+Both must rank the same pilots. Needs no database or API keys.
+
+    python benchmark_pilot_search.py --sizes 100 1000 10000 100000 --queries 200
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import statistics
+import time
+
+from gazetteer import AREA_COORDS
+from pilot_search import (
+    PilotIndex, PilotRecord, category_keywords, format_pilot, haversine_km, in_hyderabad,
+    stored_coords, search_pilots_page
+)
+
+SPECIALIZATIONS = ["Agri spraying", "Crop survey", "Mapping", "Real estate photography",
+                   "Wedding events", "Tower inspection", "Solar inspection", "Surveillance"]
+CATEGORIES = [None, "agri spraying", "3d mapping", "inspection"]
+
+def make_roster(size: int, rng: random.Random) -> list:
+    areas = list(AREA_COORDS.items())
+    pilots = []
+    for n in range(size):
+        area, (lat, lng) = rng.choice(areas)
+        pilots.append({
+            "id": f"pilot-{n}",
+            "full_name": f"Pilot {n}",
+            "specializations": ", ".join(rng.sample(SPECIALIZATIONS, 2)),
+            "hourly_rate": rng.randrange(500, 5000, 100),
+            "rating": round(rng.uniform(3, 5), 1),
+            "location": area.title(),
+            "area": area.title(),
+            "experience": f"{rng.randint(1, 10)} years",
+            "completed_jobs": rng.randint(0, 200),
+            # Spread pilots up to ~60 km around their area centre
+            "latitude": lat + rng.uniform(-0.5, 0.5),
+            "longitude": lng + rng.uniform(-0.5, 0.5)
+        })
+    return pilots
+
+def scan_search(pilots: list, lat: float, lng: float, radius_km: float, category=None, limit: int = 3) -> list:
+    """The per-call full scan the index replaces."""
+    keywords = category_keywords(category)
+    filtered = []
+    for pilot in pilots:
+        coords = stored_coords(pilot)
+        if not coords:
+            continue
+        dist = haversine_km(lat, lng, coords[0], coords[1])
+        if dist <= radius_km or in_hyderabad(*coords):
+            specs = (pilot.get("specializations") or "").lower()
+            relevance = sum(1 for kw in keywords if kw in specs)
+            filtered.append((relevance, dist, dist <= radius_km, pilot))
+    # Hyderabad pilots only count when nobody is in range of a Hyderabad search
+    in_range = [item for item in filtered if item[2]]
+    if in_range or not in_hyderabad(lat, lng):
+        filtered = in_range
+    filtered.sort(key=lambda item: (-item[0], round(item[1], 1)))
+    return [format_pilot(PilotRecord(pilot), round(dist, 1)) for _, dist, _, pilot in filtered[:limit]]
+
+def ranking_keys(results: list, category) -> list:
+    keywords = category_keywords(category)
+    return [(sum(1 for kw in keywords if kw in pilot["specialization"].lower()), pilot["distance_km"])
+            for pilot in results]
+
+def make_queries(count: int, rng: random.Random) -> list:
+    centres = list(AREA_COORDS.values())
+    queries = []
+    for _ in range(count):
+        lat, lng = rng.choice(centres)
+        queries.append((lat + rng.uniform(-0.3, 0.3), lng + rng.uniform(-0.3, 0.3),
+                        rng.choice([10, 20, 50]), rng.choice(CATEGORIES)))
+    return queries
+
+def time_queries(search, queries: list) -> tuple:
+    latencies, results = [], []
+    # Keep search debug logging out of the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        for lat, lng, radius, category in queries:
+            started_at = time.perf_counter()
+            results.append(search(lat, lng, radius, category))
+            latencies.append(time.perf_counter() - started_at)
+    return latencies, results
+
+def summarize(latencies: list) -> tuple:
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return statistics.mean(latencies) * 1000, p99 * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200, help="searches per roster size")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'pilots':>8} {'build ms':>9} {'scan mean':>10} {'scan p99':>9} "
+          f"{'index mean':>11} {'index p99':>10} {'speedup':>8}")
+
+    for size in args.sizes:
+        pilots = make_roster(size, rng)
+        queries = make_queries(args.queries, rng)
+
+        started_at = time.perf_counter()
+        index = PilotIndex([PilotRecord(pilot) for pilot in pilots])
+        build_ms = (time.perf_counter() - started_at) * 1000
+
+        scan_latencies, scan_results = time_queries(
+            lambda lat, lng, radius, category: scan_search(pilots, lat, lng, radius, category), queries)
+        index_latencies, index_results = time_queries(
+            lambda lat, lng, radius, category: search_pilots_page(index, lat, lng, radius, category)["pilots"], queries)
+
+        # Pilots tied on relevance and rounded distance may come back in either order,
+        # so compare the ranking keys
+        assert [ranking_keys(r, q[3]) for r, q in zip(scan_results, queries)] == \
+               [ranking_keys(r, q[3]) for r, q in zip(index_results, queries)], f"rankings differ at {size} pilots"
+
+        scan_mean, scan_p99 = summarize(scan_latencies)
+        index_mean, index_p99 = summarize(index_latencies)
+        print(f"{size:>8} {build_ms:>9.1f} {scan_mean:>8.3f}ms {scan_p99:>7.3f}ms "
+              f"{index_mean:>9.3f}ms {index_p99:>8.3f}ms {scan_mean / index_mean:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
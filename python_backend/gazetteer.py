@@ -0,0 +1,211 @@
+"""
+Gazetteer for placing pilots on the map from their area/location text.
+
+All known place names are compiled into one Aho-Corasick automaton, so
+resolving a pilot is a single pass over its text regardless of how many
+places are known. Only whole-word matches count ("pune" does not match
+inside another word). The pilot's area wins over its free-text location,
+and within a field the most specific place (earliest in AREA_COORDS, where
+localities precede their city and states come last) wins.
+
+Resolution runs when a pilot is created or their area/location changes (see
+geocode_pending_pilots); searches read the stored coordinates, and pilots
+whose coordinates are not stored yet are placed in memory meanwhile
+(place_unlocated_pilots).
+"""
+
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+# Known service areas. Localities precede their city and states come last,
+# since the earliest place named in a field wins.
+AREA_COORDS = {
+    # Hyderabad
+    "miyapur": (17.4968, 78.3615),
+    "kukatpally": (17.4855, 78.3885),
+    "bachupally": (17.5345, 78.3662),
+    "uppal": (17.4018, 78.5602),
+    "hyderabad": (17.3850, 78.4867),
+    # Mumbai / Navi Mumbai
+    "vashi": (19.0748, 72.9978),
+    "kurla": (19.0726, 72.8836),
+    "mumbai": (19.0760, 72.8777),
+    # Pune / Sangvi / Kothrud
+    "sangvi": (18.5721, 73.8055),
+    "kothrud": (18.5074, 73.8077),
+    "pune": (18.5204, 73.8567),
+    # Bangalore
+    "koromangla": (12.9352, 77.6244),
+    "jb nagar": (12.9716, 77.5946),
+    "bangalore": (12.9716, 77.5946),
+    # Kolkata
+    "north 24 parganas": (22.7230, 88.4873),
+    "kolkata": (22.5726, 88.3639),
+    # Solapur
+    "solapur": (17.6599, 75.9064),
+    # Coimbatore
+    "thudiyalur": (11.0742, 76.9406),
+    "saravanapatty": (11.0772, 77.0097),
+    "coimbatore": (11.0168, 76.9558),
+    # Mandi
+    "mandi": (31.5892, 76.9182),
+    # Kolhapur / Sangli / Beed
+    "kolhapur": (16.7050, 74.2433),
+    "sangli": (16.8524, 74.5815),
+    "beed": (18.9891, 75.7601),
+    "akola": (20.7002, 77.0082),
+    # Others
+    "guntur": (16.3067, 80.4365),
+    "bhopal": (23.2599, 77.4126),
+    # States / Fallback
+    "maharashtra": (18.5204, 73.8567),
+    "andrapradesh": (16.3067, 80.4365),
+}
+
+# Columns read and written by the geocoder
+PILOT_GEOCODE_COLUMNS = "id, area, location"
+GEOCODE_BATCH_SIZE = 500
+
+class Gazetteer:
+    """Aho-Corasick matcher over place names."""
+
+    def __init__(self, places: Dict[str, Tuple[float, float]]):
+        # Trie: goto[state][char] -> state; output[state] = place ranks ending here
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        self._names: List[str] = []
+        self._coords: List[Tuple[float, float]] = []
+
+        for rank, (name, coords) in enumerate(places.items()):
+            name = name.lower()
+            self._names.append(name)
+            self._coords.append(coords)
+            state = 0
+            for char in name:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].append(rank)
+
+        # Breadth-first failure links; each state inherits the outputs of its fallback
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def matches(self, text: str) -> List[int]:
+        """Ranks of the places named in text as whole words, in order of appearance."""
+        text = text.lower()
+        found = []
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for rank in self._output[state]:
+                start = end - len(self._names[rank]) + 1
+                before = text[start - 1] if start > 0 else " "
+                after = text[end + 1] if end + 1 < len(text) else " "
+                if not before.isalnum() and not after.isalnum():
+                    found.append(rank)
+        return found
+
+    def resolve(self, *fields: Optional[str]) -> Optional[Tuple[float, float]]:
+        """Coordinates of the most specific place in the first field that names one."""
+        for text in fields:
+            ranks = self.matches(text or "")
+            if ranks:
+                return self._coords[min(ranks)]
+        return None
+
+gazetteer = Gazetteer(AREA_COORDS)
+
+def geocode_pending_pilots(supabase, batch_size: int = GEOCODE_BATCH_SIZE) -> int:
+    """Resolve and store coordinates for pilots added or moved since the last run.
+
+    Pending pilots have geocoded_at NULL; the drone_pilots trigger resets it
+    whenever area or location changes. Pilots no place matches are stamped
+    too, with NULL coordinates, so they are not retried until they change.
+    Returns the number of pilots geocoded.
+    """
+    geocoded = 0
+    while True:
+        response = supabase.table('drone_pilots').select(PILOT_GEOCODE_COLUMNS).is_('geocoded_at', 'null').limit(batch_size).execute()
+        pending = response.data or []
+
+        # Pilots in the same place share one UPDATE
+        by_coords: Dict[Optional[Tuple[float, float]], List[str]] = {}
+        for pilot in pending:
+            coords = gazetteer.resolve(pilot.get("area"), pilot.get("location"))
+            by_coords.setdefault(coords, []).append(pilot["id"])
+
+        stamped = 0
+        geocoded_at = datetime.now(timezone.utc).isoformat()
+        for coords, ids in by_coords.items():
+            result = supabase.table('drone_pilots').update({
+                "latitude": coords[0] if coords else None,
+                "longitude": coords[1] if coords else None,
+                "geocoded_at": geocoded_at
+            }).in_('id', ids).execute()
+            stamped += len(result.data or [])
+        geocoded += stamped
+
+        if pending and not stamped:
+            # Typically the anon key, which RLS does not let update drone_pilots.
+            # Searches still place these pilots in memory (see place_unlocated_pilots).
+            print(f"WARNING: Could not store coordinates for {len(pending)} pending pilots; "
+                  "check that the AI backend uses SUPABASE_SERVICE_ROLE_KEY")
+            return geocoded
+
+        # A short batch is the last one
+        if len(pending) < batch_size:
+            return geocoded
+
+def place_unlocated_pilots(pilots: List[Dict]) -> int:
+    """Fill in coordinates, in memory only, for pilot rows that have none stored yet.
+
+    Covers pilots still waiting for geocode_pending_pilots (new, moved, or
+    stuck because updates are not permitted). Returns the number placed.
+    """
+    placed = 0
+    for pilot in pilots:
+        if pilot.get("latitude") is not None and pilot.get("longitude") is not None:
+            continue
+        coords = gazetteer.resolve(pilot.get("area"), pilot.get("location"))
+        if coords:
+            pilot["latitude"], pilot["longitude"] = coords
+            placed += 1
+    return placed
+
+# Addresses naming a locality and its city (or a city and its state) must place
+# the pilot at the more specific one; `python gazetteer.py` checks the ordering
+SPECIFICITY_CHECKS = [
+    ("Miyapur, Hyderabad", "miyapur"),
+    ("Vashi, Navi Mumbai", "vashi"),
+    ("Kurla West, Mumbai", "kurla"),
+    ("Kothrud, Pune", "kothrud"),
+    ("Sangvi, Pune, Maharashtra", "sangvi"),
+    ("Koromangla, Bangalore", "koromangla"),
+    ("North 24 Parganas, Kolkata", "north 24 parganas"),
+    ("Thudiyalur, Coimbatore", "thudiyalur"),
+    ("Saravanapatty, Coimbatore", "saravanapatty"),
+    ("Kolhapur, Maharashtra", "kolhapur"),
+    ("Guntur, Andrapradesh", "guntur"),
+]
+
+if __name__ == "__main__":
+    for text, place in SPECIFICITY_CHECKS:
+        resolved = gazetteer.resolve(text)
+        assert resolved == AREA_COORDS[place], f"{text!r} resolved to {resolved}, expected {place}"
+    print(f"{len(SPECIFICITY_CHECKS)} specificity checks passed")
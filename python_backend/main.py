@@ -1,8 +1,11 @@
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any, List
-from workflow import workflow_engine, supabase, model
+from workflow import workflow_engine, supabase, model, pilot_roster_available
+from pilot_search import (
+    PILOT_SEARCH_MAX_RADIUS_KM, PILOT_SEARCH_MAX_RESULTS, InvalidCursorError, pilot_snapshot, run_snapshot_refresher, search_candidates
+)
 import json
 import asyncio
 from datetime import datetime
@@ -36,8 +39,10 @@ class LocationRequest(BaseModel):
 class PilotSearchRequest(BaseModel):
     lat: float
     lng: float
-    radius_km: int
+    radius_km: int = Field(..., gt=0, le=PILOT_SEARCH_MAX_RADIUS_KM)
     category: Optional[str] = None
+    limit: int = Field(3, ge=1, le=PILOT_SEARCH_MAX_RESULTS)
+    cursor: Optional[str] = None  # next_cursor from the previous page
 
 class BookingRequest(BaseModel):
     client_id: str
@@ -50,6 +55,20 @@ class BookingRequest(BaseModel):
     payment_method: str
     requirements: Optional[Dict[str, Any]] = {}
 
+# --- Lifecycle ---
+
+@app.on_event("startup")
+async def start_pilot_snapshot_refresher():
+    # Keeps the pilot roster snapshot fresh so searches stay in memory
+    if pilot_roster_available:
+        app.state.pilot_refresher = asyncio.create_task(run_snapshot_refresher(workflow_engine.fetch_pilots))
+
+@app.on_event("shutdown")
+async def stop_pilot_snapshot_refresher():
+    refresher = getattr(app.state, "pilot_refresher", None)
+    if refresher:
+        refresher.cancel()
+
 # --- REST Endpoints ---
 
 @app.get("/")
@@ -59,7 +78,8 @@ def read_root():
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     try:
-        response = workflow_engine.process_message(request.message, request.state, request.context)
+        # Blocking LLM, Supabase and snapshot refresh calls; keep them off the event loop
+        response = await asyncio.to_thread(workflow_engine.process_message, request.message, request.state, request.context)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -72,11 +92,21 @@ async def detect_location(req: LocationRequest):
 @app.post("/api/pilots/search")
 async def search_pilots(req: PilotSearchRequest):
     try:
-        pilots = workflow_engine._search_production_pilots(req.lat, req.lng, req.radius_km, req.category)
-        return {"status": "success", "results": pilots}
+        # A stale snapshot refreshes inline (lock plus HTTP calls), so run off the event loop
+        page = await asyncio.to_thread(
+            workflow_engine._search_production_pilots, req.lat, req.lng, req.radius_km, req.category, req.limit, req.cursor
+        )
+        return {"status": "success", "results": page["pilots"], "total": page["total"], "next_cursor": page["next_cursor"]}
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/pilots/snapshot")
+async def pilot_snapshot_stats():
+    """Age, size and refresh counters of the in-memory pilot roster and its search candidate cache."""
+    return {"status": "success", "snapshot": pilot_snapshot.stats(), "search_candidates": search_candidates.stats()}
+
 @app.post("/api/bookings/create")
 async def create_booking(req: BookingRequest):
     booking_id = workflow_engine.generate_booking_id(req.service_type)
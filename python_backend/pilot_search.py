@@ -0,0 +1,527 @@
+"""
+Spatial pilot search.
+
+The active, verified roster is held in process as a PilotSnapshot of compact
+records, refreshed incrementally from drone_pilots.updated_at, so a search
+never queries the database. Located pilots are bucketed into a uniform
+lat/lng grid, so a radius search only measures the pilots in the cells that
+overlap the search circle. Distances and category relevance for those
+candidates are computed as NumPy array operations, and the top results are
+picked with argpartition rather than a full sort.
+
+Only latitude/longitude are read; pilots are placed from their area text in
+gazetteer.py.
+"""
+
+import asyncio
+import base64
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Grid cell size in degrees (0.25 deg is ~28 km of latitude)
+PILOT_INDEX_CELL_DEG = float(os.getenv("PILOT_INDEX_CELL_DEG", "0.25"))
+# Widest search radius accepted (km); the chat offers 10, 20 and 50
+PILOT_SEARCH_MAX_RADIUS_KM = 500
+# Most pilots returned per page of search results
+PILOT_SEARCH_MAX_RESULTS = 50
+# Longest a search may be served from a snapshot before it is refreshed (seconds)
+PILOT_SNAPSHOT_MAX_AGE = int(os.getenv("PILOT_SNAPSHOT_MAX_AGE", "30"))
+# Background refresh cadence; keeps searches off the database entirely
+PILOT_SNAPSHOT_REFRESH_INTERVAL = int(os.getenv("PILOT_SNAPSHOT_REFRESH_INTERVAL", "10"))
+# Deleted pilots leave no updated_at trail, so the roster is reloaded in full this often
+PILOT_SNAPSHOT_FULL_RELOAD = int(os.getenv("PILOT_SNAPSHOT_FULL_RELOAD", "600"))
+# Incremental polls re-read this many seconds before the watermark to catch late commits
+PILOT_SNAPSHOT_OVERLAP = 5
+
+# Distinct keyword sets whose relevance scores are kept per index
+RELEVANCE_CACHE_SIZE = 32
+# Relevance outweighs any distance on Earth (km) in the combined ranking key
+RELEVANCE_WEIGHT = 100_000.0
+
+# Searches within the same cell (0.01 deg is ~1.1 km) share one cached candidate set
+PILOT_RESULT_CELL_DEG = float(os.getenv("PILOT_RESULT_CELL_DEG", "0.01"))
+PILOT_RESULT_CACHE_SIZE = int(os.getenv("PILOT_RESULT_CACHE_SIZE", "256"))
+# A cell's diagonal (km) at its widest; no point in the cell is further than this from its centre
+PILOT_RESULT_CELL_DIAGONAL_KM = PILOT_RESULT_CELL_DEG * KM_PER_DEGREE * math.sqrt(2)
+
+EMPTY_ROWS = np.empty(0, dtype=np.intp)
+EMPTY_DISTANCES = np.empty(0, dtype=np.float64)
+
+# drone_pilots columns read into the roster snapshot: ranking and result-card
+# fields plus what incremental refresh needs. Skips documents, bank details
+# and other wide columns.
+PILOT_SEARCH_COLUMNS = "id, full_name, specializations, hourly_rate, rating, location, area, experience, completed_jobs, latitude, longitude, is_active, is_verified, updated_at"
+
+# The Hyderabad test area: with no pilot in range, Hyderabad pilots are shown anyway
+HYDERABAD_BOUNDS = ((17.0, 18.0), (78.0, 79.0))
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2)**2
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def stored_coords(pilot: Dict) -> Optional[Tuple[float, float]]:
+    """The pilot row's persisted coordinates (see gazetteer.geocode_pending_pilots), if any."""
+    if pilot.get("latitude") is None or pilot.get("longitude") is None:
+        return None
+    return float(pilot["latitude"]), float(pilot["longitude"])
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+def in_hyderabad(lat: float, lng: float) -> bool:
+    (min_lat, max_lat), (min_lng, max_lng) = HYDERABAD_BOUNDS
+    return min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+
+AGRI_KEYWORDS = ["agri", "crop", "spray", "spraying", "field"]
+MAPPING_KEYWORDS = ["survey", "mapping", "map", "surveillance", "real estate", "photography", "wedding", "events"]
+INSPECTION_KEYWORDS = ["inspect", "inspection", "tower", "bridge", "solar", "surveillance"]
+
+def category_keywords(category: Optional[str]) -> List[str]:
+    """Specialization keywords that make a pilot relevant to the requested category."""
+    if not category:
+        return []
+    cat_lower = category.lower()
+    if "spray" in cat_lower or "agri" in cat_lower:
+        return AGRI_KEYWORDS
+    if "map" in cat_lower or "survey" in cat_lower or "3d" in cat_lower:
+        return MAPPING_KEYWORDS
+    if "inspect" in cat_lower:
+        return INSPECTION_KEYWORDS
+    return [cat_lower]
+
+class PilotRecord:
+    """Compact roster entry: only the fields ranking and the result card use."""
+
+    __slots__ = ("id", "full_name", "specializations", "hourly_rate", "rating", "location",
+                 "area", "experience", "completed_jobs", "latitude", "longitude", "updated_at")
+
+    def __init__(self, row: Dict):
+        self.id = row.get("id")
+        self.full_name = row.get("full_name")
+        self.specializations = row.get("specializations")
+        self.hourly_rate = row.get("hourly_rate")
+        self.rating = float(row["rating"]) if row.get("rating") is not None else None
+        self.location = row.get("location")
+        self.area = row.get("area")
+        self.experience = row.get("experience")
+        self.completed_jobs = row.get("completed_jobs", 0)
+        coords = stored_coords(row)
+        self.latitude, self.longitude = coords if coords else (None, None)
+        self.updated_at = parse_timestamp(row.get("updated_at"))
+
+class PilotIndex:
+    """Array-backed roster of located pilots with a uniform grid over their coordinates.
+
+    Coordinates are held as NumPy columns, so distances for all candidates of a
+    query are computed in one vectorized pass. Each grid cell holds the row
+    numbers of the pilots inside it.
+    """
+
+    def __init__(self, pilots: List[PilotRecord], cell_deg: float = PILOT_INDEX_CELL_DEG, version: int = 0):
+        self.cell_deg = cell_deg
+        self.version = version
+        self.roster_size = len(pilots)
+        self.pilots = [pilot for pilot in pilots if pilot.latitude is not None]
+
+        self.lat = np.array([pilot.latitude for pilot in self.pilots], dtype=np.float64)
+        self.lng = np.array([pilot.longitude for pilot in self.pilots], dtype=np.float64)
+        self._lat_rad = np.radians(self.lat)
+        self._lng_rad = np.radians(self.lng)
+        self._cos_lat = np.cos(self._lat_rad)
+        self._specializations = np.array(
+            [(pilot.specializations or "").lower() for pilot in self.pilots], dtype=str
+        )
+        self._relevance: Dict[Tuple[str, ...], np.ndarray] = {}
+        # Score the standard categories up front, off the search path
+        for keywords in (AGRI_KEYWORDS, MAPPING_KEYWORDS, INSPECTION_KEYWORDS):
+            self.relevance(keywords)
+
+        rows = np.floor(self.lat / cell_deg).astype(np.int64)
+        cols = np.floor(self.lng / cell_deg).astype(np.int64)
+        cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for row_number, cell in enumerate(zip(rows.tolist(), cols.tolist())):
+            cells[cell].append(row_number)
+        self.cells = {cell: np.array(members, dtype=np.intp) for cell, members in cells.items()}
+        self.built_at = time.time()
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def distances(self, lat: float, lng: float, rows: np.ndarray) -> np.ndarray:
+        """Haversine distance in km from (lat, lng) to the pilots at the given rows."""
+        lat1 = math.radians(lat)
+        a = (np.sin((self._lat_rad[rows] - lat1) / 2) ** 2
+             + math.cos(lat1) * self._cos_lat[rows] * np.sin((self._lng_rad[rows] - math.radians(lng)) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    def within(self, lat: float, lng: float, radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, distances_km) of every located pilot within radius_km, unordered."""
+        dlat = radius_km / KM_PER_DEGREE
+        # Longitude degrees shrink towards the poles; cap the span at the whole globe
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        dlng = min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+
+        min_row, min_col = self._cell(max(lat - dlat, -90.0), lng - dlng)
+        max_row, max_col = self._cell(min(lat + dlat, 90.0), lng + dlng)
+
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self.cells):
+            # Wide searches: walking the occupied cells is cheaper than the span
+            members = [
+                cell_rows for (row, col), cell_rows in self.cells.items()
+                if min_row <= row <= max_row and min_col <= col <= max_col
+            ]
+        else:
+            members = [
+                self.cells[cell]
+                for cell in ((row, col) for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1))
+                if cell in self.cells
+            ]
+        if not members:
+            return EMPTY_ROWS, EMPTY_DISTANCES
+
+        rows = np.concatenate(members)
+        dist = self.distances(lat, lng, rows)
+        inside = dist <= radius_km
+        return rows[inside], dist[inside]
+
+    def relevance(self, keywords: List[str]) -> np.ndarray:
+        """Per-pilot count of keywords found in their specializations; cached per keyword set."""
+        key = tuple(keywords)
+        scores = self._relevance.get(key)
+        if scores is None:
+            scores = np.zeros(len(self.pilots), dtype=np.int64)
+            for kw in keywords:
+                scores += np.char.find(self._specializations, kw) >= 0
+            if len(self._relevance) >= RELEVANCE_CACHE_SIZE:
+                # Drop the oldest free-text category; the standard ones stay warm
+                self._relevance.pop(list(self._relevance)[3])
+            self._relevance[key] = scores
+        return scores
+
+    def stats(self) -> dict:
+        return {
+            "pilots": self.roster_size,
+            "located": len(self.pilots),
+            "cells": len(self.cells),
+            "age_seconds": round(time.time() - self.built_at, 1)
+        }
+
+class PilotSnapshot:
+    """In-process snapshot of the active, verified roster, refreshed incrementally.
+
+    A refresh reads only the pilots whose updated_at moved past the watermark
+    (a pilot deactivated or unverified there is dropped) and rebuilds the
+    index only if something changed. Every PILOT_SNAPSHOT_FULL_RELOAD seconds
+    the roster is read in full, which also removes deleted pilots. Searches
+    never see a snapshot older than max_age unless the database is down.
+    """
+
+    def __init__(self, max_age: int = PILOT_SNAPSHOT_MAX_AGE, full_reload: int = PILOT_SNAPSHOT_FULL_RELOAD):
+        self.max_age = max_age
+        self.full_reload = full_reload
+        self._records: Dict[str, PilotRecord] = {}
+        self._index: Optional[PilotIndex] = None
+        self._watermark: Optional[datetime] = None
+        self._refreshed_at = 0.0
+        self._reloaded_at = 0.0
+        self._lock = threading.Lock()
+        self.version = 0
+        self.full_reloads = 0
+        self.incremental_refreshes = 0
+        self.changes_applied = 0
+        self.errors = 0
+        self.last_refresh_ms = 0.0
+
+    def get(self, fetch: Callable[[Optional[datetime]], List[Dict]]) -> PilotIndex:
+        """The current index, refreshed first if it is older than max_age."""
+        if self._index is None or time.time() - self._refreshed_at >= self.max_age:
+            # Only the first load waits; otherwise one caller refreshes and the rest use the snapshot
+            self.refresh(fetch, wait=self._index is None)
+        return self._index
+
+    def refresh(self, fetch: Callable[[Optional[datetime]], List[Dict]], wait: bool = True) -> None:
+        """Apply roster changes since the last refresh. fetch(None) must return the
+        active, verified roster; fetch(since) every pilot updated at or after since."""
+        if not self._lock.acquire(blocking=wait):
+            return
+        try:
+            started_at = time.perf_counter()
+            full = self._watermark is None or time.time() - self._reloaded_at >= self.full_reload
+            since = None if full else self._watermark - timedelta(seconds=PILOT_SNAPSHOT_OVERLAP)
+            try:
+                rows = fetch(since)
+            except Exception as e:
+                self.errors += 1
+                if self._index is None:
+                    raise
+                print(f"DEBUG: Pilot snapshot refresh failed, serving snapshot v{self.version}: {e}")
+                return
+
+            records = {} if full else self._records
+            watermark = None if full else self._watermark
+            changed = False
+            for row in rows:
+                record = PilotRecord(row)
+                if record.updated_at and (watermark is None or record.updated_at > watermark):
+                    watermark = record.updated_at
+                current = self._records.get(record.id)
+                if full or (row.get("is_active") and row.get("is_verified")):
+                    # Rows already applied (the overlap window, an idle full reload) are kept as-is
+                    if current is not None and current.updated_at == record.updated_at:
+                        records[record.id] = current
+                        continue
+                    records[record.id] = record
+                    changed = True
+                    if not full:
+                        self.changes_applied += 1
+                elif records.pop(record.id, None) is not None:
+                    changed = True
+                    self.changes_applied += 1
+            # A full reload also drops pilots deleted since the last one
+            if full and records.keys() != self._records.keys():
+                changed = True
+
+            if changed or self._index is None:
+                self.version += 1
+                self._index = PilotIndex(list(records.values()), version=self.version)
+            self._records = records
+            self._watermark = watermark
+            self._refreshed_at = time.time()
+            if full:
+                self._reloaded_at = self._refreshed_at
+                self.full_reloads += 1
+            else:
+                self.incremental_refreshes += 1
+            self.last_refresh_ms = round((time.perf_counter() - started_at) * 1000, 2)
+            if changed:
+                print(f"DEBUG: Pilot snapshot v{self.version} ({'full' if full else 'incremental'}): {self._index.stats()}")
+        finally:
+            self._lock.release()
+
+    def invalidate(self) -> None:
+        """Force a full reload on the next search."""
+        self._reloaded_at = 0.0
+        self._refreshed_at = 0.0
+
+    def stats(self) -> dict:
+        index = self._index
+        return {
+            "version": self.version,
+            "pilots": index.roster_size if index else 0,
+            "located": len(index.pilots) if index else 0,
+            "cells": len(index.cells) if index else 0,
+            "age_seconds": round(time.time() - self._refreshed_at, 1) if index else None,
+            "max_age_seconds": self.max_age,
+            "watermark": self._watermark.isoformat() if self._watermark else None,
+            "full_reloads": self.full_reloads,
+            "incremental_refreshes": self.incremental_refreshes,
+            "changes_applied": self.changes_applied,
+            "errors": self.errors,
+            "last_refresh_ms": self.last_refresh_ms
+        }
+
+pilot_snapshot = PilotSnapshot()
+
+async def run_snapshot_refresher(fetch: Callable[[Optional[datetime]], List[Dict]],
+                                 interval: int = PILOT_SNAPSHOT_REFRESH_INTERVAL):
+    """Background task: refresh the pilot snapshot every `interval` seconds until cancelled."""
+    while True:
+        try:
+            await asyncio.to_thread(pilot_snapshot.refresh, fetch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"DEBUG: Pilot snapshot refresh failed: {e}")
+        await asyncio.sleep(interval)
+
+def format_pilot(pilot: PilotRecord, distance_km: Optional[float]) -> Dict:
+    return {
+        "id": pilot.id,
+        "full_name": pilot.full_name,
+        "specialization": pilot.specializations,
+        "hourly_rate": pilot.hourly_rate,
+        "rating": pilot.rating if pilot.rating is not None else 5.0,
+        "location": pilot.location,
+        "area": pilot.area,
+        "experience": pilot.experience,
+        "completed_jobs": pilot.completed_jobs,
+        "distance_km": distance_km
+    }
+
+class InvalidCursorError(ValueError):
+    """A pilot search cursor that is malformed or was not issued by search_pilots_page."""
+
+def ranking_key(relevance: np.ndarray, dist: np.ndarray) -> np.ndarray:
+    # One sort key: relevance dominates, since no distance reaches RELEVANCE_WEIGHT km
+    return np.round(dist, 1) - relevance * RELEVANCE_WEIGHT
+
+def top_k(relevance: np.ndarray, dist: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """Positions of the k best candidates (most relevant, then nearest), best first.
+
+    argpartition finds the k-th key in linear time; only the winners are sorted.
+    Ties go to the lower roster row (`rows`, default the position itself), also
+    at the cut-off, so the first k are always a prefix of the first k + n.
+    """
+    key = ranking_key(relevance, dist)
+    tie_break = rows if rows is not None else np.arange(key.size)
+    if k < key.size:
+        threshold = key[np.argpartition(key, k - 1)[k - 1]]
+        below = np.flatnonzero(key < threshold)
+        tied = np.flatnonzero(key == threshold)
+        tied = tied[np.argsort(tie_break[tied], kind="stable")][:k - below.size]
+        best = np.concatenate((below, tied))
+    else:
+        best = np.arange(key.size)
+    return best[np.lexsort((tie_break[best], key[best]))]
+
+def candidates(index: PilotIndex, lat: float, lng: float, radius_km: float,
+               rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """(rows, distances_km) of the pilots a search at (lat, lng) considers.
+
+    `rows`, if given, is a superset of the pilots within radius_km to measure
+    instead of walking the grid.
+    """
+    if rows is None:
+        rows, dist = index.within(lat, lng, radius_km)
+    else:
+        dist = index.distances(lat, lng, rows)
+        inside = dist <= radius_km
+        rows, dist = rows[inside], dist[inside]
+
+    # Local testing fallback: If empty but user is in Hyderabad, let's keep all Hyderabad pilots!
+    if not rows.size and in_hyderabad(lat, lng):
+        print("DEBUG: No pilots inside strict radius. Bypassing limit for local Hyderabad testing.")
+        (min_lat, max_lat), (min_lng, max_lng) = HYDERABAD_BOUNDS
+        rows = np.flatnonzero((index.lat >= min_lat) & (index.lat <= max_lat)
+                              & (index.lng >= min_lng) & (index.lng <= max_lng))
+        dist = index.distances(lat, lng, rows)
+    return rows, dist
+
+class CandidateCache:
+    """LRU of pilot search candidates, keyed by (location cell, radius).
+
+    An entry holds the roster rows within radius plus the cell diagonal of the
+    cell centre, which covers a search from anywhere in the cell; each search
+    then measures and ranks them from its own point. Entries belong to one
+    roster index; the cache empties itself when the snapshot moves on.
+    """
+
+    def __init__(self, maxsize: int = PILOT_RESULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._index: Optional[PilotIndex] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, index: PilotIndex, key: tuple, load: Callable[[], np.ndarray]) -> np.ndarray:
+        with self._lock:
+            if self._index is not index:
+                self._entries.clear()
+                self._index = index
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Load outside the lock; a concurrent miss on the same key just loads twice
+        entry = load()
+        with self._lock:
+            if self._index is index:
+                self._entries[key] = entry
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "version": self._index.version if self._index else None,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+search_candidates = CandidateCache()
+
+def result_cell(lat: float, lng: float) -> Tuple[int, int]:
+    return math.floor(lat / PILOT_RESULT_CELL_DEG), math.floor(lng / PILOT_RESULT_CELL_DEG)
+
+def encode_cursor(version: int, lat: float, lng: float, radius_km: float, category: Optional[str], offset: int) -> str:
+    payload = json.dumps([version, lat, lng, radius_km, category, offset], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).rstrip(b"=").decode()
+
+def decode_cursor(cursor: str) -> Tuple[int, float, float, float, Optional[str], int]:
+    try:
+        version, lat, lng, radius_km, category, offset = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        valid = (
+            isinstance(version, int) and isinstance(offset, int) and offset >= 0
+            and isinstance(lat, (int, float)) and -90 <= lat <= 90
+            and isinstance(lng, (int, float)) and -180 <= lng <= 180
+            and isinstance(radius_km, (int, float)) and 0 < radius_km <= PILOT_SEARCH_MAX_RADIUS_KM
+            and (category is None or isinstance(category, str))
+        )
+    except (ValueError, TypeError):
+        valid = False
+    if not valid:
+        raise InvalidCursorError("Invalid pilot search cursor")
+    return version, lat, lng, radius_km, category, offset
+
+def search_pilots_page(index: PilotIndex, lat: float, lng: float, radius_km: float,
+                       category: Optional[str] = None, limit: int = 3,
+                       cursor: Optional[str] = None) -> Dict:
+    """One page of the ranked pilots within radius_km, plus the cursor for the next page.
+
+    The candidates for the search's location cell (PILOT_RESULT_CELL_DEG) and
+    radius are found once and cached; every page measures them from the exact
+    search point, so distances and the radius cut-off are exact. With a
+    cursor, the location, radius and category come from the cursor. A cursor
+    only pages the roster version it was issued for; once the snapshot changes
+    it is rejected, so pages never skip or repeat pilots.
+    """
+    if cursor:
+        version, lat, lng, radius_km, category, offset = decode_cursor(cursor)
+        if version != index.version:
+            raise InvalidCursorError("Pilot roster changed since this cursor was issued; search again without a cursor")
+    else:
+        offset = 0
+    cell = result_cell(lat, lng)
+
+    def load() -> np.ndarray:
+        centre_lat = (cell[0] + 0.5) * PILOT_RESULT_CELL_DEG
+        centre_lng = (cell[1] + 0.5) * PILOT_RESULT_CELL_DEG
+        rows, _ = index.within(centre_lat, centre_lng, radius_km + PILOT_RESULT_CELL_DIAGONAL_KM)
+        return rows
+
+    nearby = search_candidates.get_or_load(index, (cell, float(radius_km)), load)
+    rows, dist = candidates(index, lat, lng, radius_km, nearby)
+    end = offset + max(limit, 0)
+    # Only the first `end` pilots are ranked; the rest of the radius stays unsorted
+    if end > 0:
+        page = top_k(index.relevance(category_keywords(category))[rows], dist, end, rows)[offset:]
+    else:
+        page = np.empty(0, dtype=np.intp)
+    return {
+        "pilots": [
+            format_pilot(index.pilots[row], round(float(distance), 1))
+            for row, distance in zip(rows[page].tolist(), dist[page].tolist())
+        ],
+        "total": int(rows.size),
+        "next_cursor": encode_cursor(index.version, lat, lng, radius_km, category, end) if end < rows.size else None
+    }
@@ -1,6 +1,5 @@
 import google.generativeai as genai
 from typing import Dict, Any, List, Optional
-import math
 import os
 import json
 import random
@@ -8,12 +7,15 @@ import string
 from datetime import datetime
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from pilot_search import PILOT_SEARCH_COLUMNS, PILOT_SEARCH_MAX_RESULTS, InvalidCursorError, pilot_snapshot, search_pilots_page
+from gazetteer import geocode_pending_pilots, place_unlocated_pilots
 
 # Load env vars from .env.local
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env.local'))
 
 url: str = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+service_role_key: str = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+key: str = service_role_key or os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
 google_api_key: str = os.environ.get("GOOGLE_API_KEY")
 
 # Initialize Gemini
@@ -32,6 +34,17 @@ if url and key:
     except Exception as e:
         print(f"DEBUG: Failed to init Supabase: {e}")
 
+# The roster snapshot learns of deactivations from its incremental poll; under the
+# anon key row-level security hides deactivated pilots, so they would stay searchable
+pilot_roster_available: bool = bool(supabase and service_role_key)
+if supabase and not service_role_key:
+    print("WARNING: SUPABASE_SERVICE_ROLE_KEY not found. Pilot search is disabled.")
+
+# Rows per request when reading the pilot roster
+PILOT_FETCH_PAGE_SIZE = 1000
+# Pilots per page of search results
+DEFAULT_PILOT_RESULTS = 3
+
 class ChatWorkflow:
     def __init__(self):
         self.system_prompt = """
@@ -202,12 +215,23 @@ CRITICAL: Never expose internal technical details. Be efficient and professional
                 category = ai_data.get("category") or context.get('category')
 
                 if lat and lng:
-                    pilots = self._search_production_pilots(lat, lng, radius, category)
+                    # "Show more" sends back the next_cursor of the previous results
+                    # The chat context is client-supplied; hold it to the /api/pilots/search bounds
+                    try:
+                        limit = int(context.get('limit') or DEFAULT_PILOT_RESULTS)
+                    except (TypeError, ValueError):
+                        limit = DEFAULT_PILOT_RESULTS
+                    limit = min(max(limit, 1), PILOT_SEARCH_MAX_RESULTS)
+                    try:
+                        page = self._search_production_pilots(lat, lng, radius, category, limit, context.get('cursor'))
+                    except InvalidCursorError:
+                        page = self._search_production_pilots(lat, lng, radius, category, limit)
+                    pilots = page["pilots"]
                     return {
-                        "message": f"I've searched within a {radius}km radius. I found {len(pilots)} qualified pilots for your mission." if pilots else f"I couldn't find any pilots within {radius}km. Please try a larger radius or search from a different area.",
+                        "message": f"I've searched within a {radius}km radius. I found {page['total']} qualified pilots for your mission." if pilots else f"I couldn't find any pilots within {radius}km. Please try a larger radius or search from a different area.",
                         "next_state": "RESULTS",
                         "action": "show_results",
-                        "data": {"pilots": pilots, "radius_km": radius}
+                        "data": {"pilots": pilots, "radius_km": radius, "total": page["total"], "next_cursor": page["next_cursor"]}
                     }
                 else:
                     return {
@@ -238,157 +262,58 @@ CRITICAL: Never expose internal technical details. Be efficient and professional
             print(f"CRITICAL ERROR: {e}")
             return {"message": "I encountered a technical glitch in my neuro-pathways. Re-trying...", "next_state": state}
 
-    def _search_production_pilots(self, lat: float, lng: float, radius_km: int, category: str = None) -> List[Dict]:
-        """Queries drone_pilots table from Supabase, calculates distance, ranks and returns available pilots."""
-        if not supabase: 
-            print("DEBUG: Supabase not connected, returning empty pilot list")
-            return []
+    def _search_production_pilots(self, lat: float, lng: float, radius_km: int, category: str = None,
+                                  limit: int = DEFAULT_PILOT_RESULTS, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Ranks active, verified pilots within radius_km from the in-memory roster snapshot.
+
+        Returns one page ({"pilots", "total", "next_cursor"}); pass next_cursor back
+        for the following page. Raises InvalidCursorError for a bad cursor.
+        """
+        empty = {"pilots": [], "total": 0, "next_cursor": None}
+        if not pilot_roster_available:
+            print("DEBUG: Pilot roster unavailable (needs the service role key), returning empty pilot list")
+            return empty
         try:
-            print(f"DEBUG: Searching pilots - lat: {lat}, lng: {lng}, radius: {radius_km}km, category: {category}")
+            print(f"DEBUG: Searching pilots - lat: {lat}, lng: {lng}, radius: {radius_km}km, category: {category}, limit: {limit}, cursor: {cursor}")
             
-            # 1. Fetch all active and verified pilots
-            query = supabase.table('drone_pilots').select('*').eq('is_verified', True).eq('is_active', True)
-            response = query.execute()
-            pilots = response.data or []
-            print(f"DEBUG: Found {len(pilots)} active and verified pilots in database")
-            
-            # Map category to matching keywords for priority sorting
-            keywords = []
-            if category:
-                cat_lower = category.lower()
-                if "spray" in cat_lower or "agri" in cat_lower:
-                    keywords = ["agri", "crop", "spray", "spraying", "field"]
-                elif "map" in cat_lower or "survey" in cat_lower or "3d" in cat_lower:
-                    keywords = ["survey", "mapping", "map", "surveillance", "real estate", "photography", "wedding", "events"]
-                elif "inspect" in cat_lower:
-                    keywords = ["inspect", "inspection", "tower", "bridge", "solar", "surveillance"]
-                else:
-                    keywords = [cat_lower]
-
-            area_coords = {
-                # Hyderabad
-                "miyapur": (17.4968, 78.3615),
-                "kukatpally": (17.4855, 78.3885),
-                "bachupally": (17.5345, 78.3662),
-                "uppal": (17.4018, 78.5602),
-                "hyderabad": (17.3850, 78.4867),
-                # Mumbai / Navi Mumbai
-                "mumbai": (19.0760, 72.8777),
-                "vashi": (19.0748, 72.9978),
-                "kurla": (19.0726, 72.8836),
-                # Pune / Sangvi / Kothrud
-                "pune": (18.5204, 73.8567),
-                "sangvi": (18.5721, 73.8055),
-                "kothrud": (18.5074, 73.8077),
-                "maharashtra": (18.5204, 73.8567),
-                # Bangalore
-                "bangalore": (12.9716, 77.5946),
-                "koromangla": (12.9352, 77.6244),
-                "jb nagar": (12.9716, 77.5946),
-                # Kolkata
-                "kolkata": (22.5726, 88.3639),
-                "north 24 parganas": (22.7230, 88.4873),
-                # Solapur
-                "solapur": (17.6599, 75.9064),
-                # Coimbatore
-                "coimbatore": (11.0168, 76.9558),
-                "thudiyalur": (11.0742, 76.9406),
-                "saravanapatty": (11.0772, 77.0097),
-                # Mandi
-                "mandi": (31.5892, 76.9182),
-                # Kolhapur / Sangli / Beed
-                "kolhapur": (16.7050, 74.2433),
-                "sangli": (16.8524, 74.5815),
-                "beed": (18.9891, 75.7601),
-                "akola": (20.7002, 77.0082),
-                # Others / Fallback
-                "guntur": (16.3067, 80.4365),
-                "andrapradesh": (16.3067, 80.4365),
-                "bhopal": (23.2599, 77.4126),
-            }
+            index = pilot_snapshot.get(self.fetch_pilots)
+            page = search_pilots_page(index, lat, lng, radius_km, category, limit, cursor)
 
-            def get_distance(lat1, lon1, lat2, lon2):
-                R = 6371.0
-                dlat = math.radians(lat2 - lat1)
-                dlon = math.radians(lon2 - lon1)
-                a = math.sin(dlat / 2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2)**2
-                c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-                return R * c
-
-            # Process and rank pilots
-            processed_pilots = []
-            for pilot in pilots:
-                p_area = (pilot.get("area") or "").lower().strip()
-                p_loc = (pilot.get("location") or "").lower().strip()
-                
-                # Resolve coordinates
-                p_coords = None
-                for key in area_coords:
-                    if key in p_area or key in p_loc:
-                        p_coords = area_coords[key]
-                        break
-                
-                # If coordinates resolved, calculate distance
-                if p_coords:
-                    dist = get_distance(lat, lng, p_coords[0], p_coords[1])
-                else:
-                    # Fallback default distance
-                    dist = 999.0
-                
-                # Calculate category relevance match
-                relevance = 0
-                specs = (pilot.get("specializations") or "").lower()
-                for kw in keywords:
-                    if kw in specs:
-                        relevance += 1
-
-                processed_pilots.append({
-                    "pilot": pilot,
-                    "distance_km": round(dist, 1) if p_coords else None,
-                    "relevance": relevance
-                })
-
-            # Filter by radius
-            filtered = []
-            for item in processed_pilots:
-                dist = item["distance_km"]
-                if dist is not None and dist <= radius_km:
-                    filtered.append(item)
-            
-            # Local testing fallback: If empty but user is in Hyderabad, let's keep all Hyderabad pilots!
-            if not filtered and (17.0 <= lat <= 18.0 and 78.0 <= lng <= 79.0):
-                print("DEBUG: No pilots inside strict radius. Bypassing limit for local Hyderabad testing.")
-                for item in processed_pilots:
-                    p_loc_lower = (item["pilot"].get("location") or "").lower()
-                    if "hyderabad" in p_loc_lower:
-                        filtered.append(item)
-
-            # Sort by relevance descending, then by distance ascending
-            filtered.sort(key=lambda x: (-x["relevance"], x["distance_km"] or 999.0))
-            
-            # Limit to top 3 and format for response
-            formatted_pilots = []
-            for item in filtered[:3]:
-                pilot = item["pilot"]
-                formatted_pilots.append({
-                    "id": pilot.get("id"),
-                    "full_name": pilot.get("full_name"),
-                    "specialization": pilot.get("specializations"),
-                    "hourly_rate": pilot.get("hourly_rate"),
-                    "rating": float(pilot.get("rating", 0)) if pilot.get("rating") is not None else 5.0,
-                    "location": pilot.get("location"),
-                    "area": pilot.get("area"),
-                    "experience": pilot.get("experience"),
-                    "completed_jobs": pilot.get("completed_jobs", 0),
-                    "distance_km": item["distance_km"]
-                })
-
-            print(f"DEBUG: Returning {len(formatted_pilots)} matched pilots: {formatted_pilots}")
-            return formatted_pilots
+            print(f"DEBUG: Returning {len(page['pilots'])} of {page['total']} matched pilots: {page['pilots']}")
+            return page
 
+        except InvalidCursorError:
+            raise
         except Exception as e:
             print(f"SEARCH ERROR: {e}")
-            return []
+            return empty
+
+    def fetch_pilots(self, since: Optional[datetime] = None) -> List[Dict]:
+        """Roster rows for the pilot snapshot: every active, verified pilot, or with
+        `since`, every pilot updated since then (including deactivated ones)."""
+        # Place pilots who joined or moved since the last load
+        try:
+            geocoded = geocode_pending_pilots(supabase)
+            if geocoded:
+                print(f"DEBUG: Geocoded {geocoded} pilots")
+        except Exception as e:
+            print(f"DEBUG: Pilot geocoding failed (continuing): {e}")
+
+        pilots = []
+        while True:
+            query = supabase.table('drone_pilots').select(PILOT_SEARCH_COLUMNS)
+            if since is None:
+                query = query.eq('is_verified', True).eq('is_active', True)
+            else:
+                query = query.gte('updated_at', since.isoformat())
+            # PostgREST caps rows per response, so read in pages
+            page = query.order('id').range(len(pilots), len(pilots) + PILOT_FETCH_PAGE_SIZE - 1).execute().data or []
+            pilots.extend(page)
+            if len(page) < PILOT_FETCH_PAGE_SIZE:
+                break
+        placed = place_unlocated_pilots(pilots)
+        print(f"DEBUG: Fetched {len(pilots)} {'changed' if since else 'active and verified'} pilots ({placed} placed in memory)")
+        return pilots
 
     # Placeholder for DB writing
     async def _create_production_booking(self, booking_data: Dict[str, Any]):
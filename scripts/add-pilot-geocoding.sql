@@ -0,0 +1,51 @@
+-- Persisted pilot coordinates for pilot search
+-- Run this in Supabase SQL Editor (after add-missing-pilot-columns.sql)
+--
+-- Pilot search reads latitude/longitude only. The AI backend fills them in from
+-- area/location (python_backend/gazetteer.py) for every pilot whose
+-- geocoded_at is NULL; this trigger sets geocoded_at back to NULL whenever
+-- a pilot's area or location changes so they are placed again.
+
+ALTER TABLE public.drone_pilots
+ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION,
+ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION,
+ADD COLUMN IF NOT EXISTS geocoded_at TIMESTAMP WITH TIME ZONE;
+
+-- Pilots that already have coordinates keep them
+UPDATE public.drone_pilots
+SET geocoded_at = NOW()
+WHERE geocoded_at IS NULL
+  AND latitude IS NOT NULL
+  AND longitude IS NOT NULL;
+
+CREATE OR REPLACE FUNCTION public.track_pilot_geocoding()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        -- Coordinates supplied at sign-up (e.g. from the browser) are used as-is
+        NEW.geocoded_at := CASE
+            WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL THEN NOW()
+        END;
+    ELSIF NEW.latitude IS DISTINCT FROM OLD.latitude OR NEW.longitude IS DISTINCT FROM OLD.longitude THEN
+        -- Coordinates set explicitly (or by the geocoder itself)
+        NEW.geocoded_at := COALESCE(NEW.geocoded_at, NOW());
+    ELSIF NEW.area IS DISTINCT FROM OLD.area OR NEW.location IS DISTINCT FROM OLD.location THEN
+        -- Moved without new coordinates: queue for the geocoder
+        NEW.latitude := NULL;
+        NEW.longitude := NULL;
+        NEW.geocoded_at := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS track_drone_pilots_geocoding ON public.drone_pilots;
+CREATE TRIGGER track_drone_pilots_geocoding
+    BEFORE INSERT OR UPDATE ON public.drone_pilots
+    FOR EACH ROW
+    EXECUTE FUNCTION public.track_pilot_geocoding();
+
+-- The geocoder's work queue
+CREATE INDEX IF NOT EXISTS idx_drone_pilots_geocode_pending
+ON public.drone_pilots(id)
+WHERE geocoded_at IS NULL;